@@ -1,19 +1,34 @@
+import logging
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from secrets import token_urlsafe
-from urllib.parse import quote_plus
 from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
-from sqlalchemy import and_, func, or_, select
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import and_, delete, func, insert, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, selectinload
 
 from app.api.deps import decode_login_from_token, get_admin_user, get_current_user
+from app.api.responses import FastJSONResponse
 from app.core.config import settings
 from app.core.security import create_access_token, hash_password, verify_password
 from app.db.deps import get_db
-from app.db.models import ChatGroup, ContactInvite, GroupMember, Message, PushSubscription, User, UserBlock, UserNote
+from app.db.models import (
+    Announcement,
+    AnnouncementRead,
+    ChangeLog,
+    ChatGroup,
+    ContactInvite,
+    GroupMember,
+    Message,
+    PushSubscription,
+    User,
+    UserBlock,
+    UserNote,
+)
 from app.db.session import AsyncSessionLocal
 from app.schemas.chat import (
     ActiveChatsOut,
@@ -21,21 +36,29 @@ from app.schemas.chat import (
     AdminUserCreateIn,
     AdminUserOut,
     AdminUserUpdateIn,
+    AnnouncementAdminOut,
+    AnnouncementCreateIn,
+    AnnouncementOut,
     ChangePasswordIn,
     CallInviteIn,
     ContactInviteOpenOut,
     ContactShareIn,
     ContactShareOut,
     GroupCreateIn,
+    GroupMembersIn,
     GroupOwnerTransferIn,
     GroupShort,
     GroupUpdateIn,
     LoginIn,
+    MessageBatchForwardIn,
     MessageEditIn,
     MessageForwardIn,
     MessageOut,
     PushPublicKeyOut,
     PushSubscriptionIn,
+    SlowQueryOut,
+    SyncChangeOut,
+    SyncOut,
     TokenOut,
     UserInfoOut,
     UserNoteIn,
@@ -44,52 +67,106 @@ from app.schemas.chat import (
     UserProfileUpdate,
     UserShort,
 )
-from app.services.realtime import realtime_hub
-from app.services.push import is_push_enabled, send_web_push
-from app.services.utils import build_display_name
-
-
+from app.services.announcements import announcement_sender
+from app.services.calls import call_registry, private_room_id
+from app.services.changelog import (
+    change_key,
+    decode_cursor,
+    encode_cursor,
+    head_key,
+    message_changes,
+    pruned_through,
+    record_changes,
+    record_group_change,
+    record_message_change,
+    record_read,
+    visible_changes,
+)
+from app.services.events import event_dispatcher
+from app.services.groups import group_members_cache, sync_group_members
+from app.services.idempotency import recent_results
+from app.services.notifications import chat_event_key
+from app.services.presence import presence_tracker
+from app.services.profiler import profiler
+from app.services.realtime import close_quietly, decode_client_frame, realtime_hub
+from app.services.slow_queries import slow_query_log
+from app.services.typing import typing_tracker
+from app.services.versions import USERS_KEY, chat_keys, notes_key, user_key, version_stamps
+from app.services.push import is_push_enabled
+from app.services.utils import build_display_name, build_message_preview
+
+
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api")
 
 
-def _preview(msg: Message, me_id: UUID) -> str:
-    base = msg.text.strip()
-    if not base and msg.file_url:
-        base = "Файл"
-    if msg.sender_id == me_id:
-        return f"Вы: {base}" if base else "Вы: сообщение"
-    return base or "Сообщение"
+# The *_row builders produce the exact fields of the matching schema as plain dicts. List endpoints
+# return them through FastJSONResponse, which skips building and validating a model per row.
+def _admin_user_row(u: User) -> dict:
+    return {
+        "id": u.id,
+        "login": u.login,
+        "role": u.role,
+        "name": build_display_name(u),
+        "first_name": u.first_name,
+        "last_name": u.last_name,
+        "middle_name": u.middle_name,
+        "phone": u.phone,
+        "email": u.email,
+        "position": u.position,
+        "avatar_url": u.avatar_url,
+        "is_blocked": u.is_blocked,
+        "is_visible": u.is_visible,
+        "created_at": u.created_at,
+    }
 
 
 def _to_admin_user(u: User) -> AdminUserOut:
-    return AdminUserOut(
-        id=u.id,
-        login=u.login,
-        role=u.role,
-        name=build_display_name(u),
-        first_name=u.first_name,
-        last_name=u.last_name,
-        middle_name=u.middle_name,
-        phone=u.phone,
-        email=u.email,
-        position=u.position,
-        avatar_url=u.avatar_url,
-        is_blocked=u.is_blocked,
-        is_visible=u.is_visible,
-        created_at=u.created_at,
-    )
+    return AdminUserOut(**_admin_user_row(u))
+
+
+def _message_row(row: Message, me_id: UUID) -> dict:
+    return {
+        "id": row.id,
+        "sender": build_display_name(row.sender),
+        "sender_avatar_url": row.sender.avatar_url or "",
+        "text": row.text,
+        "file_url": row.file_url,
+        "is_image": row.file_mime.startswith("image/"),
+        "forwarded_from_login": row.forwarded_from_login or "",
+        "forwarded_from_name": row.forwarded_from_name or "",
+        "is_mine": row.sender_id == me_id,
+        "is_read": row.is_read,
+        "time": row.created_at.strftime("%H:%M") if row.created_at else "",
+        "created_at": row.created_at,
+    }
+
+
+def _to_message_out(row: Message, me_id: UUID) -> MessageOut:
+    return MessageOut(**_message_row(row, me_id))
+
+
+def _user_short_row(
+    u: User, *, unread_count: int = 0, last_message: str = "", last_time: str = ""
+) -> dict:
+    return {
+        "id": u.id,
+        "login": u.login,
+        "name": build_display_name(u),
+        "avatar_url": u.avatar_url,
+        "phone": u.phone,
+        "email": u.email,
+        "position": u.position,
+        "unread_count": unread_count,
+        "last_message": last_message,
+        "last_time": last_time,
+        "is_group": False,
+    }
 
 
 async def _message_participants_logins(db: AsyncSession, msg: Message) -> list[str]:
     if msg.group_id:
-        members = (
-            await db.scalars(
-                select(User.login)
-                .join(GroupMember, GroupMember.user_id == User.id)
-                .where(GroupMember.group_id == msg.group_id)
-            )
-        ).all()
-        return list(set(members))
+        return await group_members_cache.member_logins(db, msg.group_id)
 
     ids = [msg.sender_id]
     if msg.receiver_user_id:
@@ -119,57 +196,6 @@ def _clean_web_push_endpoint(endpoint: str) -> str:
     return endpoint.strip()
 
 
-async def _send_push_to_logins(
-    db: AsyncSession,
-    target_logins: list[str],
-    *,
-    title: str,
-    body: str,
-    push_data: dict,
-    exclude_logins: set[str] | None = None,
-) -> None:
-    if not is_push_enabled():
-        return
-
-    exclude = exclude_logins or set()
-    filtered = [login for login in set(target_logins) if login and login not in exclude]
-    if not filtered:
-        return
-
-    users = (await db.scalars(select(User).where(User.login.in_(filtered), User.is_blocked.is_(False)))).all()
-    user_id_by_login = {u.login: u.id for u in users}
-    if not user_id_by_login:
-        return
-
-    # If user is online in websocket, skip web push to avoid duplicate notifications.
-    offline_user_ids = [uid for login, uid in user_id_by_login.items() if not realtime_hub.has_event_connection(login)]
-    if not offline_user_ids:
-        return
-
-    subscriptions = (
-        await db.scalars(select(PushSubscription).where(PushSubscription.user_id.in_(offline_user_ids)))
-    ).all()
-    if not subscriptions:
-        return
-
-    payload = {"title": title, "body": body, "data": push_data}
-    stale_ids: list[int] = []
-    for sub in subscriptions:
-        status = await send_web_push(
-            {
-                "endpoint": sub.endpoint,
-                "keys": {"p256dh": sub.p256dh, "auth": sub.auth},
-            },
-            payload,
-        )
-        if status in (404, 410):
-            stale_ids.append(sub.id)
-
-    if stale_ids:
-        await db.execute(PushSubscription.__table__.delete().where(PushSubscription.id.in_(stale_ids)))
-        await db.commit()
-
-
 @router.post("/auth/login", response_model=TokenOut)
 async def login(payload: LoginIn, db: AsyncSession = Depends(get_db)) -> TokenOut:
     user = await db.scalar(select(User).where(User.login == payload.login.strip()))
@@ -273,7 +299,10 @@ async def update_me(
     current_user.first_name = payload.first_name
     current_user.middle_name = payload.middle_name
 
+    stamp_keys = [user_key(current_user.login), USERS_KEY]
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
+    version_stamps.bump(stamp_keys)
     await db.refresh(current_user)
     return UserProfile.model_validate(current_user)
 
@@ -357,7 +386,7 @@ async def search_users(
     q: str = "",
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
-) -> list[UserShort]:
+) -> FastJSONResponse:
     stmt = (
         select(User)
         .where(User.id != current_user.id, User.is_blocked.is_(False), User.is_visible.is_(True))
@@ -366,24 +395,14 @@ async def search_users(
     users = (await db.scalars(stmt)).all()
 
     normalized = q.lower().strip()
-    result: list[UserShort] = []
+    result: list[dict] = []
     for u in users:
-        name = build_display_name(u)
-        haystack = f"{name} {u.middle_name} {u.phone} {u.email} {u.login}".lower()
+        row = _user_short_row(u)
+        haystack = f"{row['name']} {u.middle_name} {u.phone} {u.email} {u.login}".lower()
         if normalized and normalized not in haystack:
             continue
-        result.append(
-            UserShort(
-                id=u.id,
-                login=u.login,
-                name=name,
-                avatar_url=u.avatar_url,
-                phone=u.phone,
-                email=u.email,
-                position=u.position,
-            )
-        )
-    return result
+        result.append(row)
+    return FastJSONResponse(result)
 
 
 @router.get("/users/{login}", response_model=UserInfoOut)
@@ -442,14 +461,17 @@ async def set_user_note(
     elif row:
         await db.delete(row)
 
+    stamp_keys = [notes_key(current_user.login)]
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
+    version_stamps.bump(stamp_keys)
     return UserNoteOut(note=normalized)
 
 
 @router.get("/chats/active", response_model=ActiveChatsOut)
 async def active_chats(
     current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)
-) -> ActiveChatsOut:
+) -> FastJSONResponse:
     private_msgs = (
         await db.scalars(
             select(Message)
@@ -484,16 +506,10 @@ async def active_chats(
     for pid, u in users_map.items():
         last = private_last.get(pid)
         users_out.append(
-            UserShort(
-                id=u.id,
-                login=u.login,
-                name=build_display_name(u),
-                avatar_url=u.avatar_url,
-                phone=u.phone,
-                email=u.email,
-                position=u.position,
+            _user_short_row(
+                u,
                 unread_count=private_unread.get(pid, 0),
-                last_message=_preview(last, current_user.id) if last else "",
+                last_message=build_message_preview(last, current_user.id) if last else "",
                 last_time=last.created_at.strftime("%H:%M") if last and last.created_at else "",
             )
         )
@@ -507,7 +523,7 @@ async def active_chats(
         )
     ).all()
 
-    groups_out: list[GroupShort] = []
+    groups_out: list[dict] = []
     for g in groups:
         last = await db.scalar(select(Message).where(Message.group_id == g.id).order_by(Message.created_at.desc()).limit(1))
         unread = await db.scalar(
@@ -518,36 +534,33 @@ async def active_chats(
             )
         )
         groups_out.append(
-            GroupShort(
-                id=g.id,
-                name=g.name,
-                avatar_url=g.avatar_url,
-                owner_login=g.owner.login,
-                members=[gm.user.login for gm in g.members],
-                unread_count=int(unread or 0),
-                last_message=_preview(last, current_user.id) if last else "",
-                last_time=last.created_at.strftime("%H:%M") if last and last.created_at else "",
-            )
+            {
+                "id": g.id,
+                "name": g.name,
+                "avatar_url": g.avatar_url,
+                "owner_login": g.owner.login,
+                "members": [gm.user.login for gm in g.members],
+                "unread_count": int(unread or 0),
+                "last_message": build_message_preview(last, current_user.id) if last else "",
+                "last_time": last.created_at.strftime("%H:%M") if last and last.created_at else "",
+                "is_group": True,
+            }
         )
 
-    users_out.sort(key=lambda x: x.last_time, reverse=True)
-    groups_out.sort(key=lambda x: x.last_time, reverse=True)
-    return ActiveChatsOut(users=users_out, groups=groups_out)
+    users_out.sort(key=lambda x: x["last_time"], reverse=True)
+    groups_out.sort(key=lambda x: x["last_time"], reverse=True)
+    return FastJSONResponse({"users": users_out, "groups": groups_out})
 
 
-@router.get("/messages", response_model=list[MessageOut])
-async def get_messages(
-    chat_type: str,
-    target: str,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
-) -> list[MessageOut]:
+async def _mark_chat_read(
+    db: AsyncSession, current_user: User, chat_type: str, target: str
+) -> tuple[User | None, UUID | None]:
     if chat_type == "private":
         partner = await db.scalar(select(User).where(User.login == target, User.is_blocked.is_(False)))
         if not partner:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-        await db.execute(
+        result = await db.execute(
             Message.__table__.update()
             .where(
                 Message.sender_id == partner.id,
@@ -557,8 +570,47 @@ async def get_messages(
             )
             .values(is_read=True)
         )
+        stamp_keys: list[str] = []
+        if result.rowcount:
+            await record_read(db, current_user.id, current_user.login, partner_id=partner.id)
+            stamp_keys = chat_keys(chat_event_key("private", partner.login, current_user.login), [current_user.login])
+            await version_stamps.publish(db, stamp_keys)
+        await db.commit()
+        version_stamps.bump(stamp_keys)
+        return partner, None
+
+    if chat_type == "group":
+        group_id = UUID(target)
+        if not await group_members_cache.is_member(db, group_id, current_user.id):
+            raise HTTPException(status_code=403, detail="Нет доступа к группе")
+
+        result = await db.execute(
+            Message.__table__.update()
+            .where(Message.group_id == group_id, Message.sender_id != current_user.id, Message.is_read.is_(False))
+            .values(is_read=True)
+        )
+        stamp_keys = []
+        if result.rowcount:
+            await record_read(db, current_user.id, current_user.login, group_id=group_id)
+            # Group unread counters do not depend on the reader, so every member's chat list changes.
+            stamp_keys = chat_keys(f"group:{group_id}", await group_members_cache.member_logins(db, group_id))
+            await version_stamps.publish(db, stamp_keys)
         await db.commit()
+        version_stamps.bump(stamp_keys)
+        return None, group_id
+
+    raise HTTPException(status_code=400, detail="chat_type должен быть private или group")
 
+
+@router.get("/messages", response_model=list[MessageOut])
+async def get_messages(
+    chat_type: str,
+    target: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> FastJSONResponse:
+    partner, group_id = await _mark_chat_read(db, current_user, chat_type, target)
+    if partner:
         stmt = (
             select(Message)
             .options(selectinload(Message.sender))
@@ -571,75 +623,109 @@ async def get_messages(
             )
             .order_by(Message.created_at)
         )
-    elif chat_type == "group":
-        group_id = UUID(target)
-        membership = await db.scalar(
-            select(GroupMember).where(GroupMember.group_id == group_id, GroupMember.user_id == current_user.id)
-        )
-        if not membership:
-            raise HTTPException(status_code=403, detail="Нет доступа к группе")
-
-        await db.execute(
-            Message.__table__.update()
-            .where(Message.group_id == group_id, Message.sender_id != current_user.id, Message.is_read.is_(False))
-            .values(is_read=True)
-        )
-        await db.commit()
-
+    else:
         stmt = (
             select(Message)
             .options(selectinload(Message.sender))
             .where(Message.group_id == group_id)
             .order_by(Message.created_at)
         )
-    else:
-        raise HTTPException(status_code=400, detail="chat_type должен быть private или group")
 
     rows = (await db.scalars(stmt)).all()
-    return [
-        MessageOut(
-            id=row.id,
-            sender=build_display_name(row.sender),
-            sender_avatar_url=row.sender.avatar_url or "",
-            text=row.text,
-            file_url=row.file_url,
-            is_image=row.file_mime.startswith("image/"),
-            forwarded_from_login=row.forwarded_from_login or "",
-            forwarded_from_name=row.forwarded_from_name or "",
-            is_mine=row.sender_id == current_user.id,
-            is_read=row.is_read,
-            time=row.created_at.strftime("%H:%M") if row.created_at else "",
-            created_at=row.created_at,
-        )
-        for row in rows
-    ]
+    return FastJSONResponse([_message_row(row, current_user.id) for row in rows])
 
 
-@router.post("/messages")
-async def send_message(
-    chat_type: str = Form(...),
-    target: str = Form(...),
-    text: str = Form(""),
-    file: UploadFile | None = File(default=None),
+@router.get("/sync", response_model=SyncOut)
+async def sync_changes(
+    cursor: str = "",
+    limit: int = 200,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
-) -> dict:
-    if not text and not file:
-        raise HTTPException(status_code=400, detail="Пустое сообщение")
+) -> SyncOut:
+    # Without a cursor the client is expected to do a full load; it gets the current head to resume from.
+    if not cursor:
+        return SyncOut(cursor=encode_cursor(await head_key(db)), reset=True)
+    try:
+        after = decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    limit = max(1, min(limit, settings.sync_max_page_size))
+
+    # Changes after the cursor were pruned: the client has to reload.
+    pruned = await pruned_through(db)
+    if pruned is not None and after < pruned:
+        return SyncOut(cursor=encode_cursor(await head_key(db)), reset=True)
+
+    # Group rows are visible from the caller's latest join onwards, not from the group's creation.
+    # Members from before the log existed, or whose join row was pruned, see every retained row.
+    joined = aliased(ChangeLog)
+    joined_later = (
+        select(joined.id)
+        .where(
+            joined.user_id == current_user.id,
+            joined.kind == "group.joined",
+            joined.target == ChangeLog.target,
+            tuple_(joined.xid, joined.id) > change_key(),
+        )
+        .correlate(ChangeLog)
+        .exists()
+    )
+    my_groups = select(GroupMember.group_id).where(GroupMember.user_id == current_user.id)
+    rows = (
+        await db.scalars(
+            select(ChangeLog)
+            .where(
+                change_key() > tuple_(*after),
+                visible_changes(),
+                or_(
+                    ChangeLog.user_id == current_user.id,
+                    and_(ChangeLog.group_id.in_(my_groups), ~joined_later),
+                ),
+            )
+            .order_by(ChangeLog.xid, ChangeLog.id)
+            .limit(limit + 1)
+        )
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    peer_ids = {UUID(r.target) for r in rows if r.chat_type == "private"}
+    peers = dict((await db.execute(select(User.id, User.login).where(User.id.in_(peer_ids)))).all()) if peer_ids else {}
+    message_ids = {r.message_id for r in rows if r.message_id and r.kind != "message.deleted"}
+    messages = (
+        (
+            await db.scalars(select(Message).options(selectinload(Message.sender)).where(Message.id.in_(message_ids)))
+        ).all()
+        if message_ids
+        else []
+    )
+    return SyncOut(
+        cursor=encode_cursor((rows[-1].xid, rows[-1].id) if rows else after),
+        has_more=has_more,
+        changes=[
+            SyncChangeOut(
+                kind=r.kind,
+                chat_type=r.chat_type,
+                target=peers.get(UUID(r.target), "") if r.chat_type == "private" else r.target,
+                message_id=r.message_id,
+                data=r.data,
+            )
+            for r in rows
+        ],
+        messages=[_to_message_out(m, current_user.id) for m in sorted(messages, key=lambda m: m.created_at)],
+    )
 
-    file_url = ""
-    file_mime = ""
-    if file:
-        upload_root = Path(settings.upload_dir)
-        upload_root.mkdir(parents=True, exist_ok=True)
-        suffix = Path(file.filename or "").suffix
-        safe_name = f"{uuid4()}{suffix}" if suffix else str(uuid4())
-        target_path = upload_root / safe_name
-        content = await file.read()
-        target_path.write_bytes(content)
-        file_url = f"{settings.upload_base_url.rstrip('/')}/{safe_name}"
-        file_mime = file.content_type or "application/octet-stream"
 
+async def _create_message(
+    db: AsyncSession,
+    current_user: User,
+    chat_type: str,
+    target: str,
+    text: str,
+    *,
+    file_url: str = "",
+    file_mime: str = "",
+) -> Message:
     msg = Message(sender_id=current_user.id, text=text.strip(), file_url=file_url, file_mime=file_mime, is_read=False)
     notify_logins = [current_user.login]
 
@@ -653,93 +739,77 @@ async def send_message(
         notify_logins.append(partner.login)
     elif chat_type == "group":
         group_id = UUID(target)
-        membership = await db.scalar(
-            select(GroupMember).where(GroupMember.group_id == group_id, GroupMember.user_id == current_user.id)
-        )
-        if not membership:
+        members = await group_members_cache.members(db, group_id)
+        if current_user.id not in members:
             raise HTTPException(status_code=403, detail="Нет доступа к группе")
         msg.group_id = group_id
-        members = (
-            await db.scalars(
-                select(User.login)
-                .join(GroupMember, GroupMember.user_id == User.id)
-                .where(GroupMember.group_id == group_id)
-            )
-        ).all()
-        notify_logins.extend(members)
+        notify_logins.extend(members.values())
     else:
         raise HTTPException(status_code=400, detail="chat_type должен быть private или group")
 
     db.add(msg)
+    await record_message_change(db, "message.created", msg)
+    stamp_keys = chat_keys(chat_event_key(chat_type, target, current_user.login), set(notify_logins))
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
+    version_stamps.bump(stamp_keys)
 
-    await realtime_hub.notify_users(
-        list(set(notify_logins)),
+    await event_dispatcher.publish(
+        "message.created",
         {
-            "type": "message:new",
+            "recipients": list(set(notify_logins)),
             "chat_type": chat_type,
             "target": target,
             "sender_login": current_user.login,
             "sender_name": build_display_name(current_user),
             "preview": _event_preview(msg.text, msg.file_url),
         },
+        key=chat_event_key(chat_type, target, current_user.login),
     )
-    await _send_push_to_logins(
-        db,
-        notify_logins,
-        title=build_display_name(current_user),
-        body=_event_preview(msg.text, msg.file_url),
-        push_data={
-            "type": "message:new",
-            "chat_type": chat_type,
-            "target": target,
-            "sender_login": current_user.login,
-        },
-        exclude_logins={current_user.login},
-    )
-    return {"status": "success"}
+    return msg
 
 
-@router.put("/messages/{message_id}")
-async def edit_message(
-    message_id: UUID,
-    payload: MessageEditIn,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
-) -> dict:
+def _message_event_key(msg: Message, participants: list[str]) -> str:
+    if msg.group_id:
+        return f"group:{msg.group_id}"
+    # Same key as chat_event_key, also for a chat with oneself.
+    return chat_event_key("private", participants[0], participants[-1])
+
+
+async def _edit_message(db: AsyncSession, current_user: User, message_id: UUID, text: str) -> Message:
     msg = await db.scalar(select(Message).where(Message.id == message_id))
     if not msg:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
     if msg.sender_id != current_user.id:
         raise HTTPException(status_code=403, detail="Можно редактировать только свои сообщения")
 
-    new_text = payload.text.strip()
+    new_text = text.strip()
     if not new_text and not msg.file_url:
         raise HTTPException(status_code=400, detail="Пустое сообщение")
     msg.text = new_text
+    await record_message_change(db, "message.updated", msg)
+    participants = await _message_participants_logins(db, msg)
+    stamp_keys = chat_keys(_message_event_key(msg, participants), participants)
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
+    version_stamps.bump(stamp_keys)
 
-    participants = await _message_participants_logins(db, msg)
-    await realtime_hub.notify_users(
-        participants,
+    await event_dispatcher.publish(
+        "message.updated",
         {
-            "type": "message:update",
+            "recipients": participants,
             "chat_type": "group" if msg.group_id else "private",
             "target": str(msg.group_id or msg.receiver_user_id or ""),
             "sender_login": current_user.login,
             "sender_name": build_display_name(current_user),
             "preview": _event_preview(msg.text, msg.file_url),
         },
+        key=_message_event_key(msg, participants),
     )
-    return {"status": "success"}
+    return msg
 
 
-@router.delete("/messages/{message_id}")
-async def delete_message(
-    message_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
-) -> dict:
+async def _delete_message(db: AsyncSession, current_user: User, message_id: UUID) -> None:
     msg = await db.scalar(select(Message).where(Message.id == message_id))
     if not msg:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
@@ -749,27 +819,92 @@ async def delete_message(
     participants = await _message_participants_logins(db, msg)
     chat_type = "group" if msg.group_id else "private"
     target = str(msg.group_id or msg.receiver_user_id or "")
+    key = _message_event_key(msg, participants)
+    await record_message_change(db, "message.deleted", msg)
     await db.delete(msg)
+    stamp_keys = chat_keys(key, participants)
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
-    await realtime_hub.notify_users(participants, {"type": "message:delete", "chat_type": chat_type, "target": target})
+    version_stamps.bump(stamp_keys)
+    await event_dispatcher.publish(
+        "message.deleted",
+        {"recipients": participants, "chat_type": chat_type, "target": target},
+        key=key,
+    )
+
+
+async def _idempotent(current_user: User, op: str, key: str | None, factory) -> dict:
+    # Retries carrying the same Idempotency-Key get the stored result instead of a second write.
+    if not key:
+        return await factory()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Некорректный Idempotency-Key")
+    return await recent_results.run(current_user.login, f"{op}:{key}", factory)
+
+
+@router.post("/messages")
+async def send_message(
+    chat_type: str = Form(...),
+    target: str = Form(...),
+    text: str = Form(""),
+    file: UploadFile | None = File(default=None),
+    idempotency_key: str = Form(""),
+    idempotency_header: str | None = Header(default=None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    if not text and not file:
+        raise HTTPException(status_code=400, detail="Пустое сообщение")
+
+    async def create() -> dict:
+        file_url = ""
+        file_mime = ""
+        if file:
+            upload_root = Path(settings.upload_dir)
+            upload_root.mkdir(parents=True, exist_ok=True)
+            suffix = Path(file.filename or "").suffix
+            safe_name = f"{uuid4()}{suffix}" if suffix else str(uuid4())
+            target_path = upload_root / safe_name
+            content = await file.read()
+            target_path.write_bytes(content)
+            file_url = f"{settings.upload_base_url.rstrip('/')}/{safe_name}"
+            file_mime = file.content_type or "application/octet-stream"
+
+        msg = await _create_message(db, current_user, chat_type, target, text, file_url=file_url, file_mime=file_mime)
+        return {"status": "success", "message_id": str(msg.id)}
+
+    return await _idempotent(current_user, "message.send", idempotency_header or idempotency_key, create)
+
+
+@router.put("/messages/{message_id}")
+async def edit_message(
+    message_id: UUID,
+    payload: MessageEditIn,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    await _edit_message(db, current_user, message_id, payload.text)
     return {"status": "success"}
 
 
-@router.post("/messages/{message_id}/forward")
-async def forward_message(
+@router.delete("/messages/{message_id}")
+async def delete_message(
     message_id: UUID,
-    payload: MessageForwardIn,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ) -> dict:
+    await _delete_message(db, current_user, message_id)
+    return {"status": "success"}
+
+
+async def _forward_message(
+    db: AsyncSession, current_user: User, message_id: UUID, payload: MessageForwardIn
+) -> Message:
     source = await db.scalar(select(Message).options(selectinload(Message.sender)).where(Message.id == message_id))
     if not source:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
     if source.group_id:
-        membership = await db.scalar(
-            select(GroupMember).where(GroupMember.group_id == source.group_id, GroupMember.user_id == current_user.id)
-        )
-        if not membership:
+        if not await group_members_cache.is_member(db, source.group_id, current_user.id):
             raise HTTPException(status_code=403, detail="Нет доступа к сообщению")
     elif source.sender_id != current_user.id and source.receiver_user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Нет доступа к сообщению")
@@ -793,50 +928,234 @@ async def forward_message(
         notify_logins.append(partner.login)
     elif payload.chat_type == "group":
         group_id = UUID(payload.target)
-        membership = await db.scalar(
-            select(GroupMember).where(GroupMember.group_id == group_id, GroupMember.user_id == current_user.id)
-        )
-        if not membership:
+        members = await group_members_cache.members(db, group_id)
+        if current_user.id not in members:
             raise HTTPException(status_code=403, detail="Нет доступа к группе")
         forwarded.group_id = group_id
-        members = (
-            await db.scalars(
-                select(User.login)
-                .join(GroupMember, GroupMember.user_id == User.id)
-                .where(GroupMember.group_id == group_id)
-            )
-        ).all()
-        notify_logins.extend(members)
+        notify_logins.extend(members.values())
     else:
         raise HTTPException(status_code=400, detail="chat_type должен быть private или group")
 
     db.add(forwarded)
+    await record_message_change(db, "message.created", forwarded)
+    stamp_keys = chat_keys(chat_event_key(payload.chat_type, payload.target, current_user.login), set(notify_logins))
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
-    await realtime_hub.notify_users(
-        list(set(notify_logins)),
+    version_stamps.bump(stamp_keys)
+    await event_dispatcher.publish(
+        "message.created",
         {
-            "type": "message:new",
+            "recipients": list(set(notify_logins)),
             "chat_type": payload.chat_type,
             "target": payload.target,
             "sender_login": current_user.login,
             "sender_name": build_display_name(current_user),
             "preview": _event_preview(forwarded.text, forwarded.file_url),
+            "forwarded": True,
         },
+        key=chat_event_key(payload.chat_type, payload.target, current_user.login),
     )
-    await _send_push_to_logins(
+    return forwarded
+
+
+@router.post("/messages/{message_id}/forward")
+async def forward_message(
+    message_id: UUID,
+    payload: MessageForwardIn,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    async def forward() -> dict:
+        forwarded = await _forward_message(db, current_user, message_id, payload)
+        return {"status": "success", "message_id": str(forwarded.id)}
+
+    return await _idempotent(current_user, f"message.forward:{message_id}", idempotency_key, forward)
+
+
+async def _forward_messages(db: AsyncSession, current_user: User, payload: MessageBatchForwardIn) -> list[UUID]:
+    message_ids = list(dict.fromkeys(payload.message_ids))
+    targets = list(dict.fromkeys((t.chat_type, t.target) for t in payload.targets))
+    if not message_ids or not targets:
+        raise HTTPException(status_code=400, detail="Не указаны сообщения или получатели")
+    if len(message_ids) > settings.forward_max_messages or len(targets) > settings.forward_max_targets:
+        raise HTTPException(status_code=400, detail="Слишком много сообщений или получателей")
+
+    sources = {
+        m.id: m
+        for m in (
+            await db.scalars(select(Message).options(selectinload(Message.sender)).where(Message.id.in_(message_ids)))
+        ).all()
+    }
+    if len(sources) != len(message_ids):
+        raise HTTPException(status_code=404, detail="Сообщение не найдено")
+    for source in sources.values():
+        if source.group_id:
+            if not await group_members_cache.is_member(db, source.group_id, current_user.id):
+                raise HTTPException(status_code=403, detail="Нет доступа к сообщению")
+        elif source.sender_id != current_user.id and source.receiver_user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Нет доступа к сообщению")
+
+    private_logins = {target for chat_type, target in targets if chat_type == "private"}
+    partners: dict[str, User] = {}
+    if private_logins:
+        partners = {
+            u.login: u
+            for u in (
+                await db.scalars(select(User).where(User.login.in_(private_logins), User.is_blocked.is_(False)))
+            ).all()
+        }
+        if len(partners) != len(private_logins):
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        blocked_by = await db.scalar(
+            select(UserBlock.id).where(
+                UserBlock.blocker_user_id.in_([u.id for u in partners.values()]),
+                UserBlock.blocked_user_id == current_user.id,
+            ).limit(1)
+        )
+        if blocked_by:
+            raise HTTPException(status_code=403, detail="Вы заблокированы этим пользователем")
+
+    rows: list[dict] = []
+    chats: list[dict] = []
+    # The rows share one transaction, and now() is fixed for a transaction on Postgres. Explicit,
+    # strictly increasing timestamps keep the forwarded messages in the order they were picked.
+    sent_at = datetime.now(timezone.utc)
+    for chat_type, target in targets:
+        if chat_type == "private":
+            destination = {"receiver_user_id": partners[target].id}
+            recipients = list(dict.fromkeys([current_user.login, target]))
+        elif chat_type == "group":
+            group_id = UUID(target)
+            members = await group_members_cache.members(db, group_id)
+            if current_user.id not in members:
+                raise HTTPException(status_code=403, detail="Нет доступа к группе")
+            destination = {"group_id": group_id}
+            recipients = list(members.values())
+        else:
+            raise HTTPException(status_code=400, detail="chat_type должен быть private или group")
+        chats.append({"chat_type": chat_type, "target": target, "recipients": recipients})
+        for position, message_id in enumerate(message_ids):
+            source = sources[message_id]
+            rows.append(
+                {
+                    "id": uuid4(),
+                    "created_at": sent_at + timedelta(microseconds=position),
+                    "sender_id": current_user.id,
+                    "text": source.text,
+                    "file_url": source.file_url,
+                    "file_mime": source.file_mime,
+                    "forwarded_from_login": source.sender.login if source.sender else "",
+                    "forwarded_from_name": build_display_name(source.sender) if source.sender else "",
+                    "is_read": False,
+                    **destination,
+                }
+            )
+
+    await db.execute(insert(Message), rows)
+    await record_changes(
         db,
-        notify_logins,
-        title=f"{build_display_name(current_user)} (переслано)",
-        body=_event_preview(forwarded.text, forwarded.file_url),
-        push_data={
-            "type": "message:new",
-            "chat_type": payload.chat_type,
-            "target": payload.target,
+        [
+            change
+            for row in rows
+            for change in message_changes(
+                "message.created", row["id"], row["sender_id"], row.get("receiver_user_id"), row.get("group_id")
+            )
+        ],
+    )
+    stamp_keys = [
+        key
+        for chat in chats
+        for key in chat_keys(chat_event_key(chat["chat_type"], chat["target"], current_user.login), chat["recipients"])
+    ]
+    await version_stamps.publish(db, stamp_keys)
+    await db.commit()
+    version_stamps.bump(stamp_keys)
+
+    first = sources[message_ids[0]]
+    preview = (
+        _event_preview(first.text, first.file_url)
+        if len(message_ids) == 1
+        else f"Пересланные сообщения: {len(message_ids)}"
+    )
+    await event_dispatcher.publish(
+        "messages.forwarded",
+        {
             "sender_login": current_user.login,
+            "sender_name": build_display_name(current_user),
+            "preview": preview,
+            "chats": chats,
         },
-        exclude_logins={current_user.login},
+        key=chat_event_key(targets[0][0], targets[0][1], current_user.login),
+    )
+    return [row["id"] for row in rows]
+
+
+@router.post("/messages/forward")
+async def forward_messages(
+    payload: MessageBatchForwardIn,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    async def forward() -> dict:
+        ids = await _forward_messages(db, current_user, payload)
+        return {"status": "success", "message_ids": [str(i) for i in ids]}
+
+    return await _idempotent(current_user, "message.forward_batch", idempotency_key, forward)
+
+
+async def _publish_group_delta(
+    db: AsyncSession,
+    group: ChatGroup,
+    recipients: set[str],
+    added: set[UUID],
+    removed: set[UUID],
+) -> None:
+    changed_ids = added | removed
+    logins = (
+        dict((await db.execute(select(User.id, User.login).where(User.id.in_(changed_ids)))).all())
+        if changed_ids
+        else {}
+    )
+    # Every member's chat list shows the group's name and members, so every remaining member gets
+    # the delta; removed users get it too so they can drop the group.
+    members = await group_members_cache.member_logins(db, group.id)
+    recipients = recipients | set(logins.values()) | set(members)
+    await version_stamps.bump_committed(db, chat_keys(f"group:{group.id}", recipients))
+    await event_dispatcher.publish(
+        "group.changed",
+        {
+            "group_id": str(group.id),
+            "recipients": list(recipients),
+            "delta": {
+                "name": group.name,
+                "avatar_url": group.avatar_url,
+                "members_added": [logins[uid] for uid in added if uid in logins],
+                "members_removed": [logins[uid] for uid in removed if uid in logins],
+            },
+        },
+        key=f"group:{group.id}",
+    )
+
+
+async def _load_owned_group(db: AsyncSession, group_id: UUID, current_user: User, detail: str) -> ChatGroup:
+    group = await db.scalar(select(ChatGroup).where(ChatGroup.id == group_id))
+    if not group:
+        raise HTTPException(status_code=404, detail="Группа не найдена")
+    if group.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail=detail)
+    return group
+
+
+async def _group_short_after_change(db: AsyncSession, group: ChatGroup, owner_login: str) -> GroupShort:
+    return GroupShort(
+        id=group.id,
+        name=group.name,
+        avatar_url=group.avatar_url,
+        owner_login=owner_login,
+        members=await group_members_cache.member_logins(db, group.id),
     )
-    return {"status": "success"}
 
 
 @router.post("/groups", response_model=GroupShort)
@@ -859,8 +1178,11 @@ async def create_group(
     for u in members:
         db.add(GroupMember(group_id=group.id, user_id=u.id))
 
+    await record_group_change(db, group.id, added=[u.id for u in members])
+    await group_members_cache.publish_invalidation(db, group.id)
     await db.commit()
-    await realtime_hub.notify_users([u.login for u in members], {"type": "chat:update"})
+    group_members_cache.invalidate(group.id)
+    await _publish_group_delta(db, group, set(), {u.id for u in members}, set())
 
     return GroupShort(
         id=group.id,
@@ -878,33 +1200,104 @@ async def update_group(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ) -> GroupShort:
-    group = await db.scalar(select(ChatGroup).where(ChatGroup.id == group_id).options(selectinload(ChatGroup.owner)))
-    if not group:
-        raise HTTPException(status_code=404, detail="Группа не найдена")
-    if group.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Только владелец может редактировать группу")
+    group = await _load_owned_group(db, group_id, current_user, "Только владелец может редактировать группу")
+
+    added: set[UUID] = set()
+    removed: set[UUID] = set()
+    if payload.members is not None:
+        member_logins = set(payload.members)
+        member_logins.add(current_user.login)
+        member_ids = set(
+            (
+                await db.scalars(
+                    select(User.id).where(User.login.in_(list(member_logins)), User.is_blocked.is_(False))
+                )
+            ).all()
+        )
+        added, removed = await sync_group_members(db, group.id, member_ids)
+
+    new_name = payload.name.strip()
+    new_avatar = payload.avatar_url.strip()
+    info_changed = new_name != group.name or new_avatar != group.avatar_url
+    group.name = new_name
+    group.avatar_url = new_avatar
+
+    if info_changed or added or removed:
+        await record_group_change(db, group.id, added=added, removed=removed)
+    if added or removed:
+        await group_members_cache.publish_invalidation(db, group.id)
+    await db.commit()
+    if added or removed:
+        group_members_cache.invalidate(group.id)
 
-    member_logins = set(payload.members)
-    member_logins.add(current_user.login)
-    members = (await db.scalars(select(User).where(User.login.in_(list(member_logins)), User.is_blocked.is_(False)))).all()
-    await db.execute(GroupMember.__table__.delete().where(GroupMember.group_id == group_id))
+    result = await _group_short_after_change(db, group, current_user.login)
+    if info_changed or added or removed:
+        await _publish_group_delta(db, group, {current_user.login}, added, removed)
+    return result
 
-    for u in members:
-        db.add(GroupMember(group_id=group.id, user_id=u.id))
 
-    group.name = payload.name.strip()
-    group.avatar_url = payload.avatar_url.strip()
+@router.post("/groups/{group_id}/members", response_model=GroupShort)
+async def add_group_members(
+    group_id: UUID,
+    payload: GroupMembersIn,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> GroupShort:
+    group = await _load_owned_group(db, group_id, current_user, "Только владелец может добавлять участников")
+
+    member_ids = set(
+        (
+            await db.scalars(
+                select(User.id).where(User.login.in_(list(set(payload.logins))), User.is_blocked.is_(False))
+            )
+        ).all()
+    )
+    if not member_ids:
+        raise HTTPException(status_code=400, detail="Участники не найдены")
+    added, _ = await sync_group_members(db, group.id, member_ids, remove_missing=False)
 
+    if added:
+        await record_group_change(db, group.id, added=added)
+        await group_members_cache.publish_invalidation(db, group.id)
     await db.commit()
-    await realtime_hub.notify_users([u.login for u in members], {"type": "chat:update"})
+    if added:
+        group_members_cache.invalidate(group.id)
+        await _publish_group_delta(db, group, {current_user.login}, added, set())
+    return await _group_short_after_change(db, group, current_user.login)
 
-    return GroupShort(
-        id=group.id,
-        name=group.name,
-        avatar_url=group.avatar_url,
-        owner_login=current_user.login,
-        members=[u.login for u in members],
+
+@router.delete("/groups/{group_id}/members/{login}")
+async def remove_group_member(
+    group_id: UUID,
+    login: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    group = await db.scalar(select(ChatGroup).where(ChatGroup.id == group_id))
+    if not group:
+        raise HTTPException(status_code=404, detail="Группа не найдена")
+    target = await db.scalar(select(User).where(User.login == login))
+    if not target:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    # Any member may leave the group; only the owner may remove others.
+    if group.owner_id != current_user.id and target.id != current_user.id:
+        raise HTTPException(status_code=403, detail="Только владелец может удалять участников")
+    if target.id == group.owner_id:
+        raise HTTPException(status_code=400, detail="Нельзя удалить владельца группы")
+
+    result = await db.execute(
+        delete(GroupMember).where(GroupMember.group_id == group.id, GroupMember.user_id == target.id)
     )
+    if not result.rowcount:
+        return {"status": "success"}
+
+    await record_group_change(db, group.id, removed=[target.id])
+    await group_members_cache.publish_invalidation(db, group.id)
+    await db.commit()
+    group_members_cache.invalidate(group.id)
+    owner_login = await db.scalar(select(User.login).where(User.id == group.owner_id))
+    await _publish_group_delta(db, group, {current_user.login, owner_login}, set(), {target.id})
+    return {"status": "success"}
 
 
 @router.post("/groups/{group_id}/owner", response_model=GroupShort)
@@ -931,12 +1324,15 @@ async def transfer_group_owner(
         raise HTTPException(status_code=400, detail="Новый владелец должен быть участником группы")
 
     group.owner_id = new_owner.id
+    await record_group_change(db, group.id)
+    await group_members_cache.publish_invalidation(db, group.id)
     await db.commit()
+    group_members_cache.invalidate(group.id)
     await db.refresh(group)
     await db.refresh(new_owner)
 
     member_logins = [m.user.login for m in group.members]
-    await realtime_hub.notify_users(member_logins, {"type": "chat:update"})
+    await _publish_group_delta(db, group, set(member_logins), set(), set())
     return GroupShort(
         id=group.id,
         name=group.name,
@@ -963,9 +1359,17 @@ async def delete_group(
         raise HTTPException(status_code=403, detail="Только владелец может удалить группу")
 
     member_logins = [m.user.login for m in group.members]
+    await record_group_change(db, group_id, removed=[m.user_id for m in group.members], deleted=True)
     await db.delete(group)
+    await group_members_cache.publish_invalidation(db, group_id)
     await db.commit()
-    await realtime_hub.notify_users(member_logins, {"type": "chat:update"})
+    group_members_cache.invalidate(group_id)
+    await version_stamps.bump_committed(db, chat_keys(f"group:{group_id}", member_logins))
+    await event_dispatcher.publish(
+        "group.changed",
+        {"group_id": str(group_id), "recipients": member_logins, "delta": {"deleted": True}},
+        key=f"group:{group_id}",
+    )
     return {"status": "success"}
 
 
@@ -993,14 +1397,14 @@ async def admin_users(
     q: str = "",
     _: User = Depends(get_admin_user),
     db: AsyncSession = Depends(get_db),
-) -> list[AdminUserOut]:
+) -> FastJSONResponse:
     rows = (await db.scalars(select(User).order_by(User.created_at.desc()))).all()
     qn = q.lower().strip()
     if qn:
         rows = [
             u for u in rows if qn in f"{u.login} {u.first_name} {u.last_name} {u.phone} {u.email}".lower()
         ]
-    return [_to_admin_user(u) for u in rows]
+    return FastJSONResponse([_admin_user_row(u) for u in rows])
 
 
 @router.post("/admin/users", response_model=AdminUserOut)
@@ -1026,7 +1430,9 @@ async def admin_create_user(
         is_visible=payload.is_visible,
     )
     db.add(u)
+    await version_stamps.publish(db, [USERS_KEY])
     await db.commit()
+    version_stamps.bump([USERS_KEY])
     await db.refresh(u)
     return _to_admin_user(u)
 
@@ -1064,11 +1470,16 @@ async def admin_update_user(
             raise HTTPException(status_code=400, detail="ID уже занят")
         u.id = payload.id
 
+    old_login = u.login
+    login_changed = False
     if payload.login is not None and payload.login.strip() and payload.login.strip() != u.login:
         exists_login = await db.scalar(select(User).where(User.login == payload.login.strip()))
         if exists_login:
             raise HTTPException(status_code=400, detail="Логин уже занят")
         u.login = payload.login.strip()
+        login_changed = True
+        # Group member lists are cached by login.
+        await group_members_cache.publish_invalidation(db)
 
     for field in ["role", "first_name", "last_name", "middle_name", "phone", "email", "position", "avatar_url", "is_visible"]:
         value = getattr(payload, field)
@@ -1081,7 +1492,18 @@ async def admin_update_user(
     if payload.password:
         u.password_hash = hash_password(payload.password)
 
+    # Sockets were authorized for the old login; a renamed or blocked user has to reconnect.
+    close_sockets = login_changed or payload.is_blocked is True
+    # Logins, visibility and blocking feed almost every cached response; start over.
+    await version_stamps.publish_reset(db)
+    if close_sockets:
+        await realtime_hub.publish_close_user(db, old_login)
     await db.commit()
+    version_stamps.reset()
+    if login_changed:
+        group_members_cache.invalidate()
+    if close_sockets:
+        realtime_hub.close_user(old_login)
     await db.refresh(u)
     return _to_admin_user(u)
 
@@ -1154,37 +1576,22 @@ async def invite_call(
     if target.id == current_user.id:
         raise HTTPException(status_code=400, detail="Нельзя звонить самому себе")
 
-    db.add(
-        Message(
-            sender_id=current_user.id,
-            receiver_user_id=target.id,
-            text="📞 Попытка звонка",
-            is_read=False,
-        )
-    )
+    msg = Message(sender_id=current_user.id, receiver_user_id=target.id, text="📞 Попытка звонка", is_read=False)
+    db.add(msg)
+    await record_message_change(db, "message.created", msg)
+    stamp_keys = chat_keys(chat_event_key("private", target.login, current_user.login), {current_user.login, target.login})
+    await version_stamps.publish(db, stamp_keys)
     await db.commit()
-    await realtime_hub.notify_users([current_user.login, target.login], {"type": "chat:update"})
-
-    await realtime_hub.notify_users(
-        [target.login],
+    version_stamps.bump(stamp_keys)
+    call_registry.invite(private_room_id(current_user.login, target.login))
+    await event_dispatcher.publish(
+        "call.invited",
         {
-            "type": "call:invite",
-            "from_login": current_user.login,
-            "from_name": build_display_name(current_user),
-        },
-    )
-    await _send_push_to_logins(
-        db,
-        [target.login],
-        title="Входящий звонок",
-        body=f"{build_display_name(current_user)} звонит вам",
-        push_data={
-            "type": "call:invite",
             "from_login": current_user.login,
             "from_name": build_display_name(current_user),
-            "url": f"/?incoming_call={quote_plus(current_user.login)}&incoming_name={quote_plus(build_display_name(current_user))}",
+            "target_login": target.login,
         },
-        exclude_logins={current_user.login},
+        key=chat_event_key("private", target.login, current_user.login),
     )
     return {"status": "success"}
 
@@ -1203,11 +1610,260 @@ async def admin_block_user(
         raise HTTPException(status_code=400, detail="Нельзя заблокировать самого себя")
 
     u.is_blocked = payload.is_blocked
+    await version_stamps.publish_reset(db)
+    if u.is_blocked:
+        await realtime_hub.publish_close_user(db, u.login)
     await db.commit()
+    version_stamps.reset()
+    if u.is_blocked:
+        realtime_hub.close_user(u.login)
     await db.refresh(u)
     return _to_admin_user(u)
 
 
+def _to_announcement_admin(a: Announcement) -> AnnouncementAdminOut:
+    return AnnouncementAdminOut(
+        id=a.id,
+        title=a.title,
+        text=a.text,
+        status=a.status,
+        recipients_total=a.recipients_total,
+        delivered_count=a.delivered_count,
+        created_at=a.created_at,
+        finished_at=a.finished_at,
+    )
+
+
+@router.post("/admin/announcements", response_model=AnnouncementAdminOut)
+async def admin_create_announcement(
+    payload: AnnouncementCreateIn,
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+) -> AnnouncementAdminOut:
+    title = payload.title.strip()
+    if not title:
+        raise HTTPException(status_code=400, detail="Заголовок обязателен")
+
+    total = await db.scalar(select(func.count()).select_from(User).where(User.is_blocked.is_(False)))
+    announcement = Announcement(
+        author_user_id=admin.id, title=title, text=payload.text.strip(), recipients_total=total or 0
+    )
+    db.add(announcement)
+    await db.commit()
+    await db.refresh(announcement)
+    # Delivery runs in the background; progress is visible through GET /admin/announcements/{id}.
+    announcement_sender.schedule(announcement.id)
+    return _to_announcement_admin(announcement)
+
+
+@router.get("/admin/slow-queries", response_model=list[SlowQueryOut])
+async def admin_slow_queries(_: User = Depends(get_admin_user)) -> list[SlowQueryOut]:
+    return [
+        SlowQueryOut(
+            id=q.id,
+            at=q.at,
+            duration_ms=q.duration_ms,
+            route=q.route,
+            statement=q.statement,
+            params=q.params,
+            plan=q.plan,
+            explain_error=q.explain_error,
+        )
+        for q in slow_query_log.records()
+    ]
+
+
+@router.delete("/admin/slow-queries")
+async def admin_clear_slow_queries(_: User = Depends(get_admin_user)) -> dict:
+    slow_query_log.clear()
+    return {"status": "success"}
+
+
+@router.get("/admin/profile", response_class=PlainTextResponse)
+async def admin_profile(
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    _: User = Depends(get_admin_user),
+) -> PlainTextResponse:
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds: до 60, interval_ms: от 1 до 1000")
+    try:
+        profile = await profiler.profile(seconds, interval_ms / 1000)
+    except RuntimeError:
+        raise HTTPException(status_code=409, detail="Профилирование уже запущено")
+    return PlainTextResponse(profile)
+
+
+@router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def admin_request_profile(profile_id: str, _: User = Depends(get_admin_user)) -> PlainTextResponse:
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return PlainTextResponse(profile)
+
+
+@router.get("/admin/announcements", response_model=list[AnnouncementAdminOut])
+async def admin_announcements(
+    _: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+) -> list[AnnouncementAdminOut]:
+    rows = (await db.scalars(select(Announcement).order_by(Announcement.created_at.desc()).limit(50))).all()
+    return [_to_announcement_admin(a) for a in rows]
+
+
+@router.get("/admin/announcements/{announcement_id}", response_model=AnnouncementAdminOut)
+async def admin_announcement(
+    announcement_id: UUID,
+    _: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+) -> AnnouncementAdminOut:
+    announcement = await db.get(Announcement, announcement_id)
+    if not announcement:
+        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    return _to_announcement_admin(announcement)
+
+
+@router.get("/announcements", response_model=list[AnnouncementOut])
+async def announcements(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> list[AnnouncementOut]:
+    # Read state is stored only for announcements the user has opened; no row means unread.
+    rows = (
+        await db.execute(
+            select(Announcement, AnnouncementRead.id)
+            .outerjoin(
+                AnnouncementRead,
+                and_(AnnouncementRead.announcement_id == Announcement.id, AnnouncementRead.user_id == current_user.id),
+            )
+            .order_by(Announcement.created_at.desc())
+            .limit(50)
+        )
+    ).all()
+    return [
+        AnnouncementOut(id=a.id, title=a.title, text=a.text, created_at=a.created_at, is_read=read_id is not None)
+        for a, read_id in rows
+    ]
+
+
+@router.post("/announcements/{announcement_id}/read")
+async def read_announcement(
+    announcement_id: UUID,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    if not await db.get(Announcement, announcement_id):
+        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    exists = await db.scalar(
+        select(AnnouncementRead.id).where(
+            AnnouncementRead.announcement_id == announcement_id, AnnouncementRead.user_id == current_user.id
+        )
+    )
+    if not exists:
+        db.add(AnnouncementRead(announcement_id=announcement_id, user_id=current_user.id))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+    return {"status": "success"}
+
+
+async def _ws_send_message(db: AsyncSession, user: User, frame: dict) -> dict:
+    text = str(frame.get("text") or "")
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="Пустое сообщение")
+    msg = await _create_message(db, user, str(frame["chat_type"]), str(frame["target"]), text)
+    return {"message_id": str(msg.id)}
+
+
+async def _ws_edit_message(db: AsyncSession, user: User, frame: dict) -> dict:
+    msg = await _edit_message(db, user, UUID(str(frame["message_id"])), str(frame.get("text") or ""))
+    return {"message_id": str(msg.id)}
+
+
+async def _ws_delete_message(db: AsyncSession, user: User, frame: dict) -> dict:
+    await _delete_message(db, user, UUID(str(frame["message_id"])))
+    return {}
+
+
+async def _ws_mark_read(db: AsyncSession, user: User, frame: dict) -> dict:
+    await _mark_chat_read(db, user, str(frame["chat_type"]), str(frame["target"]))
+    return {}
+
+
+async def _ws_typing_start(db: AsyncSession, user: User, frame: dict) -> dict:
+    chat_type, target = str(frame["chat_type"]), str(frame["target"])
+    key = chat_event_key(chat_type, target, user.login)
+    if typing_tracker.refresh(user.login, key):
+        return {}
+
+    if chat_type == "private":
+        partner = await db.scalar(select(User).where(User.login == target, User.is_blocked.is_(False)))
+        if not partner:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if await _is_blocked_by(db, blocker_id=partner.id, blocked_id=user.id):
+            raise HTTPException(status_code=403, detail="Вы заблокированы этим пользователем")
+        recipients = [user.login, partner.login]
+    elif chat_type == "group":
+        members = await group_members_cache.members(db, UUID(target))
+        if user.id not in members:
+            raise HTTPException(status_code=403, detail="Нет доступа к группе")
+        recipients = list(members.values())
+    else:
+        raise HTTPException(status_code=400, detail="chat_type должен быть private или group")
+
+    await typing_tracker.start(user.login, key, chat_type, target, recipients)
+    return {}
+
+
+async def _ws_typing_stop(db: AsyncSession, user: User, frame: dict) -> dict:
+    typing_tracker.stop(user.login, chat_event_key(str(frame["chat_type"]), str(frame["target"]), user.login))
+    return {}
+
+
+_WS_OPS = {
+    "message.send": _ws_send_message,
+    "message.edit": _ws_edit_message,
+    "message.delete": _ws_delete_message,
+    "chat.read": _ws_mark_read,
+    "typing.start": _ws_typing_start,
+    "typing.stop": _ws_typing_stop,
+}
+
+
+async def _handle_ws_request(user: User, frame: dict) -> dict:
+    # Request frame: {"op": ..., "id": <client id>, ...}; the reply is an ack with the same id.
+    # The id doubles as an idempotency key shared with the HTTP endpoints, so a send retried
+    # over POST /messages with Idempotency-Key set to the same id is not written twice.
+    request_id = frame.get("id")
+    reply: dict = {"type": "ack", "id": request_id}
+    handler = _WS_OPS.get(frame.get("op"))
+    if handler is None:
+        return {**reply, "ok": False, "status": 400, "detail": "Неизвестная операция"}
+
+    async def run() -> dict:
+        async with AsyncSessionLocal() as db:
+            # The socket can outlive the access it was opened with: the user is read again for every op.
+            current = await db.scalar(select(User).where(User.id == user.id))
+            if not current or current.is_blocked or current.login != user.login:
+                raise HTTPException(status_code=401, detail="Доступ запрещен")
+            return await handler(db, current, frame)
+
+    try:
+        if request_id is None:
+            result = await run()
+        else:
+            result = await recent_results.run(user.login, f"{frame['op']}:{request_id}", run)
+    except HTTPException as exc:
+        return {**reply, "ok": False, "status": exc.status_code, "detail": exc.detail}
+    except (KeyError, TypeError, ValueError):
+        return {**reply, "ok": False, "status": 400, "detail": "Некорректный запрос"}
+    except Exception:
+        logger.exception("WebSocket op %s failed", frame.get("op"))
+        return {**reply, "ok": False, "status": 500, "detail": "Внутренняя ошибка сервера"}
+    return {**reply, "ok": True, "result": result}
+
+
 @router.websocket("/ws/events")
 async def ws_events(websocket: WebSocket):
     token = websocket.query_params.get("token")
@@ -1227,11 +1883,35 @@ async def ws_events(websocket: WebSocket):
             await websocket.close(code=1008)
             return
 
-    await realtime_hub.connect_events(login, websocket)
+    # Clients opt in to batched frames (a JSON array of events per flush) with ?batch=1.
+    batch = websocket.query_params.get("batch", "") in {"1", "true"}
+    if not await realtime_hub.connect_events(login, websocket, batch=batch):
+        return
     try:
+        await presence_tracker.attach(user, websocket)
         while True:
-            await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            realtime_hub.touch(login, websocket)
+            frame = decode_client_frame(message)
+            if not frame or "op" not in frame:
+                continue
+            try:
+                decode_login_from_token(token)
+            except ValueError:
+                reply = {"type": "ack", "id": frame.get("id"), "ok": False, "status": 401, "detail": "Сессия истекла"}
+            else:
+                reply = await _handle_ws_request(user, frame)
+            # Frames sent without an id (typing updates, usually) are only answered when they fail.
+            if reply["id"] is not None or not reply["ok"]:
+                await realtime_hub.reply(login, websocket, reply)
+            if reply.get("status") == 401:
+                await close_quietly(websocket, 1008)
+                break
     except WebSocketDisconnect:
+        pass
+    finally:
         realtime_hub.disconnect_events(login, websocket)
 
 
@@ -1250,14 +1930,21 @@ async def ws_calls(websocket: WebSocket, room_id: str):
 
     async with AsyncSessionLocal() as db:
         user = await db.scalar(select(User).where(User.login == login))
-        if not user or user.is_blocked:
+        if not user or user.is_blocked or not await call_registry.authorize(db, room_id, user):
             await websocket.close(code=1008)
             return
 
-    await realtime_hub.connect_call(room_id, websocket)
+    await websocket.accept()
+    # ?batch=1 peers accept {"type": "ice", "candidates": [...]} frames.
+    batch = websocket.query_params.get("batch", "") in {"1", "true"}
+    if not call_registry.join(room_id, websocket, login, batch=batch):
+        await websocket.close(code=1013)
+        return
     try:
         while True:
             msg = await websocket.receive_text()
-            await realtime_hub.broadcast_call(room_id, websocket, msg)
+            call_registry.relay(room_id, websocket, msg)
     except WebSocketDisconnect:
-        realtime_hub.disconnect_call(room_id, websocket)
+        pass
+    finally:
+        call_registry.leave(room_id, websocket)
@@ -8,12 +8,53 @@ class Settings(BaseSettings):
     secret_key: str = "change-me"
     access_token_expire_minutes: int = 60 * 24 * 7
     database_url: str = "postgresql+asyncpg://mg:mg@db:5432/mgmessenger"
+    sqlite_busy_timeout_ms: int = 5000
     upload_dir: str = "./uploads"
     upload_base_url: str = "http://localhost:8000/uploads"
     cors_origins: str = "http://localhost:5173,http://localhost:3000"
     vapid_public_key: str = ""
     vapid_private_key: str = ""
     vapid_subject: str = "mailto:admin@example.com"
+    push_coalesce_window_seconds: float = 30.0
+    event_workers: int = 4
+    event_queue_size: int = 1000
+    event_drain_seconds: float = 5.0
+    group_cache_ttl_seconds: float = 300.0
+    group_cache_max_groups: int = 10000
+    ws_batch_interval_ms: int = 25
+    ws_batch_max_events: int = 100
+    idempotency_ttl_seconds: float = 600.0
+    ws_ping_interval_seconds: float = 20.0
+    ws_idle_timeout_seconds: float = 75.0
+    ws_max_connections_per_user: int = 5
+    ws_max_connections: int = 10000
+    presence_offline_grace_seconds: float = 10.0
+    presence_batch_interval_ms: int = 1000
+    presence_max_group_size: int = 200
+    typing_ttl_seconds: float = 6.0
+    typing_min_interval_seconds: float = 1.0
+    typing_broadcast_interval_ms: int = 1000
+    typing_group_detail_limit: int = 20
+    call_invite_ttl_seconds: float = 120.0
+    call_room_max_peers: int = 8
+    call_room_idle_seconds: float = 120.0
+    call_peer_queue_size: int = 256
+    call_ice_batch_ms: int = 20
+    announcement_chunk_size: int = 500
+    announcement_chunk_interval_seconds: float = 1.0
+    forward_max_messages: int = 50
+    forward_max_targets: int = 50
+    sync_max_page_size: int = 500
+    sync_retention_days: float = 30.0
+    sync_prune_interval_seconds: float = 3600.0
+    metrics_token: str = ""
+    query_budget: int = 50
+    query_budget_strict: bool = False
+    server_timing_header: bool = False
+    slow_query_ms: float = 0.0
+    slow_query_log_size: int = 100
+    slow_query_explain: bool = True
+    slow_query_explain_timeout_seconds: float = 10.0
 
 
 settings = Settings()
@@ -1,4 +1,5 @@
 ﻿import re
+from pathlib import Path
 
 from sqlalchemy import select, text
 
@@ -9,9 +10,14 @@ from app.db.session import AsyncSessionLocal, engine
 
 
 async def ensure_columns() -> None:
+    # Upgrades databases created before these columns existed. Only Postgres deployments are that
+    # old; on SQLite create_all has already built the current schema.
+    if engine.dialect.name != "postgresql":
+        return
     statements = [
         "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE",
         "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_visible BOOLEAN DEFAULT TRUE",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMPTZ NULL",
         "ALTER TABLE messages ADD COLUMN IF NOT EXISTS is_read BOOLEAN DEFAULT FALSE",
         "ALTER TABLE messages ADD COLUMN IF NOT EXISTS forwarded_from_login VARCHAR(128) DEFAULT ''",
         "ALTER TABLE messages ADD COLUMN IF NOT EXISTS forwarded_from_name VARCHAR(255) DEFAULT ''",
@@ -28,6 +34,12 @@ async def ensure_columns() -> None:
         )
         """,
         "CREATE INDEX IF NOT EXISTS ix_contact_invites_token ON contact_invites(token)",
+        # Rows logged before xid existed sort first, in id order, which is how they were read.
+        "ALTER TABLE change_log ADD COLUMN IF NOT EXISTS xid BIGINT NOT NULL DEFAULT 0",
+        "DROP INDEX IF EXISTS ix_change_log_user_id_id",
+        "DROP INDEX IF EXISTS ix_change_log_group_id_id",
+        "CREATE INDEX IF NOT EXISTS ix_change_log_user_id_xid_id ON change_log(user_id, xid, id)",
+        "CREATE INDEX IF NOT EXISTS ix_change_log_group_id_xid_id ON change_log(group_id, xid, id)",
     ]
     async with engine.begin() as conn:
         for sql in statements:
@@ -122,6 +134,8 @@ async def repair_mojibake_data() -> None:
 
 
 async def init_db() -> None:
+    if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        Path(engine.url.database).parent.mkdir(parents=True, exist_ok=True)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
@@ -1,4 +1,5 @@
-﻿from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+﻿from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from app.core.config import settings
 
@@ -6,3 +7,18 @@ from app.core.config import settings
 engine = create_async_engine(settings.database_url, future=True, echo=False)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
+
+if engine.dialect.name == "sqlite":
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, _record) -> None:
+        # WAL lets readers work while one writer commits; foreign_keys makes ON DELETE CASCADE apply.
+        cursor = dbapi_connection.cursor()
+        for pragma in (
+            "journal_mode=WAL",
+            "synchronous=NORMAL",
+            "foreign_keys=ON",
+            f"busy_timeout={settings.sqlite_busy_timeout_ms}",
+        ):
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
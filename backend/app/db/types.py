@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import BigInteger, DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement, now
+from sqlalchemy.types import TypeDecorator
+
+
+class UTCDateTime(TypeDecorator):
+    # TIMESTAMPTZ on Postgres. SQLite has no time zones: values are stored as UTC text and come
+    # back aware again, so comparisons with datetime.now(timezone.utc) work on both.
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value: datetime | None, dialect) -> datetime | None:
+        if value is not None and dialect.name == "sqlite" and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value: datetime | None, dialect) -> datetime | None:
+        if value is not None and dialect.name == "sqlite" and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+
+@compiles(now, "sqlite")
+def _sqlite_now(element, compiler, **kw) -> str:
+    # CURRENT_TIMESTAMP only has whole seconds; messages sent within one second must keep their order.
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+class current_xid(FunctionElement):
+    # Id of the writing transaction. Only Postgres needs it: SQLite has one writer at a time, so
+    # rows there commit in insert order and every row gets 0.
+    type = BigInteger()
+    inherit_cache = True
+
+
+class snapshot_xmin(FunctionElement):
+    # Oldest transaction still running: every transaction below it has committed or rolled back.
+    # On SQLite every row has xid 0, which is always below it.
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(current_xid)
+def _current_xid(element, compiler, **kw) -> str:
+    return "0"
+
+
+@compiles(current_xid, "postgresql")
+def _pg_current_xid(element, compiler, **kw) -> str:
+    return "pg_current_xact_id()::text::bigint"
+
+
+@compiles(snapshot_xmin)
+def _snapshot_xmin(element, compiler, **kw) -> str:
+    return "1"
+
+
+@compiles(snapshot_xmin, "postgresql")
+def _pg_snapshot_xmin(element, compiler, **kw) -> str:
+    return "pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
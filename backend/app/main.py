@@ -1,19 +1,115 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from sqlalchemy import select
 
 from app.api.deps import decode_login_from_token
 from app.api.routes import router
 from app.core.config import settings
-from app.db.models import GroupMember, Message, User
-from app.db.session import AsyncSessionLocal
+from app.db.models import Message, User
+from app.db.session import AsyncSessionLocal, engine
+from app.services.announcements import announcement_sender
+from app.services.calls import call_registry
+from app.services.changelog import change_log_pruner
+from app.services.events import event_dispatcher
+from app.services.groups import group_members_cache
+from app.services.invalidation import invalidation_bus
+from app.services.metrics import MetricsMiddleware, instrument_engine, state_gauges
+from app.services.notifications import chat_event_key, register_event_handlers
+from app.services.presence import presence_tracker
+from app.services.profiler import ProfilingMiddleware
+from app.services.realtime import realtime_hub
+from app.services.slow_queries import slow_query_log
+from app.services.versions import USERS_KEY, chats_key, notes_key, track_request_bumps, user_key, version_stamps
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    register_event_handlers()
+    await event_dispatcher.start()
+    await invalidation_bus.start()
+    await realtime_hub.start()
+    await call_registry.start()
+    await announcement_sender.start()
+    await change_log_pruner.start()
+    yield
+    await change_log_pruner.stop()
+    await announcement_sender.stop()
+    await call_registry.stop()
+    await presence_tracker.stop()
+    await realtime_hub.stop()
+    await invalidation_bus.stop()
+    await event_dispatcher.stop()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
+
+
+def _version_keys(login: str, request: Request) -> tuple[str, list[str]] | None:
+    path = request.url.path
+    # The caller's own stamp is in every ETag, so blocking them or renaming them forces a full request.
+    me = user_key(login)
+    if path == "/api/me":
+        return path, [me]
+    if path == "/api/users/search":
+        return path, [me, USERS_KEY]
+    if path == "/api/chats/active":
+        return path, [me, USERS_KEY, chats_key(login)]
+    if path == "/api/messages":
+        chat_type = request.query_params.get("chat_type", "")
+        target = request.query_params.get("target", "")
+        if chat_type not in ("private", "group") or not target:
+            return None
+        return path, [me, USERS_KEY, "chat:" + chat_event_key(chat_type, target, login)]
+    if path.startswith("/api/users/"):
+        other = path.removeprefix("/api/users/")
+        if not other or "/" in other:
+            return None
+        return "/api/users/{login}", [me, user_key(other), notes_key(login)]
+    return None
+
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    # Answers polling GETs from the version stamps alone: an unchanged resource costs no query at all.
+    # The stamps live in this process, so this only holds with a single worker, as deployed now:
+    # other workers would learn about bumps over the invalidation bus with a delay and could answer
+    # 304 for a resource that has just changed.
+    versioned = None
+    token = _extract_token(request) if request.method == "GET" else None
+    if token:
+        try:
+            login = decode_login_from_token(token)
+        except ValueError:
+            login = None
+        versioned = _version_keys(login, request) if login else None
+    if versioned is None:
+        return await call_next(request)
+
+    path, keys = versioned
+    extra = f"{login}|{request.url.path}?{request.url.query}"
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    etag = version_stamps.etag(keys, extra)
+    if etag in request.headers.get("if-none-match", ""):
+        # Never routed, so tell the metrics middleware which route this was.
+        request.scope["route_path"] = path
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+
+    # The handler may bump the stamps itself (GET /api/messages marks the chat read), so the ETag is
+    # taken after it ran. If someone else bumped them meanwhile, the body may predate that write and
+    # the response goes out without an ETag.
+    before = version_stamps.state(keys)
+    track_request_bumps()
+    response = await call_next(request)
+    if response.status_code == 200 and not version_stamps.changed_by_others(keys, before):
+        response.headers.update({**headers, "ETag": version_stamps.etag(keys, extra)})
+    return response
 
 
-app = FastAPI(title=settings.app_name)
-
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[origin.strip() for origin in settings.cors_origins.split(",") if origin.strip()],
@@ -21,6 +117,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, is_admin=lambda scope: _is_admin_request(Request(scope)))
+# Outermost, so the latency covers the other middlewares too.
+app.add_middleware(MetricsMiddleware)
+
+instrument_engine(engine)
+slow_query_log.install(engine)
+state_gauges.add("mg_ws_event_connections", "Open /ws/events sockets", realtime_hub.connection_count)
+state_gauges.add("mg_ws_connected_users", "Users with at least one events socket", realtime_hub.connected_users)
+state_gauges.add("mg_ws_buffered_events", "Events waiting in per-socket batch buffers", realtime_hub.buffered_events)
+state_gauges.add("mg_event_queue_depth", "Events queued for the dispatcher workers", event_dispatcher.queue_depth)
+state_gauges.add("mg_call_rooms", "Open call rooms", call_registry.room_count)
+state_gauges.add("mg_call_peers", "Sockets joined to call rooms", call_registry.peer_count)
 
 uploads = Path(settings.upload_dir)
 uploads.mkdir(parents=True, exist_ok=True)
@@ -35,19 +143,37 @@ def _extract_token(request: Request) -> str | None:
     return request.query_params.get("token")
 
 
+_admin_checks: dict[str, tuple[str, bool]] = {}
+
+
+async def _is_admin_request(request: Request) -> bool:
+    token = _extract_token(request)
+    if not token:
+        return False
+    try:
+        login = decode_login_from_token(token)
+    except ValueError:
+        return False
+    # Role changes and blocking reset the version stamps, so an answer is reused only while the
+    # user's stamp is unchanged; repeated X-Profile headers from a non-admin cost no query.
+    stamp = version_stamps.etag([user_key(login)])
+    cached = _admin_checks.get(login)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.login == login))
+    is_admin = bool(user and not user.is_blocked and user.role.lower() == "admin")
+    _admin_checks[login] = (stamp, is_admin)
+    return is_admin
+
+
 async def _can_read_message_file(login: str, msg: Message) -> bool:
     async with AsyncSessionLocal() as db:
         user = await db.scalar(select(User).where(User.login == login))
         if not user or user.is_blocked:
             return False
         if msg.group_id:
-            member = await db.scalar(
-                select(GroupMember.id).where(
-                    GroupMember.group_id == msg.group_id,
-                    GroupMember.user_id == user.id,
-                )
-            )
-            return member is not None
+            return await group_members_cache.is_member(db, msg.group_id, user.id)
         return user.id in {msg.sender_id, msg.receiver_user_id}
 
 
@@ -92,3 +218,10 @@ async def get_upload(file_name: str, request: Request):
 @app.get("/health")
 async def health() -> dict:
     return {"status": "ok"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request) -> Response:
+    if settings.metrics_token and _extract_token(request) != settings.metrics_token:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
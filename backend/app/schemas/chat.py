@@ -96,6 +96,22 @@ class MessageOut(BaseModel):
     created_at: datetime
 
 
+class SyncChangeOut(BaseModel):
+    kind: str
+    chat_type: str
+    target: str
+    message_id: UUID | None = None
+    data: dict | None = None
+
+
+class SyncOut(BaseModel):
+    cursor: str
+    has_more: bool = False
+    reset: bool = False
+    changes: list[SyncChangeOut] = []
+    messages: list[MessageOut] = []
+
+
 class GroupCreateIn(BaseModel):
     name: str
     members: list[str]
@@ -104,7 +120,11 @@ class GroupCreateIn(BaseModel):
 class GroupUpdateIn(BaseModel):
     name: str
     avatar_url: str = ""
-    members: list[str]
+    members: list[str] | None = None
+
+
+class GroupMembersIn(BaseModel):
+    logins: list[str]
 
 
 class GroupOwnerTransferIn(BaseModel):
@@ -182,6 +202,11 @@ class MessageForwardIn(BaseModel):
     target: str
 
 
+class MessageBatchForwardIn(BaseModel):
+    message_ids: list[UUID]
+    targets: list[MessageForwardIn]
+
+
 class ContactShareIn(BaseModel):
     target_login: str
 
@@ -216,4 +241,39 @@ class PushPublicKeyOut(BaseModel):
     enabled: bool
 
 
+class AnnouncementCreateIn(BaseModel):
+    title: str
+    text: str = ""
+
+
+class AnnouncementOut(BaseModel):
+    id: UUID
+    title: str
+    text: str
+    created_at: datetime
+    is_read: bool = False
+
+
+class AnnouncementAdminOut(BaseModel):
+    id: UUID
+    title: str
+    text: str
+    status: str
+    recipients_total: int
+    delivered_count: int
+    created_at: datetime
+    finished_at: datetime | None = None
+
+
+class SlowQueryOut(BaseModel):
+    id: int
+    at: datetime
+    duration_ms: float
+    route: str
+    statement: str
+    params: list[str]
+    plan: str | None = None
+    explain_error: str = ""
+
+
 TokenOut.model_rebuild()
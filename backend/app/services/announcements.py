@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timezone
+from uuid import UUID
+
+from sqlalchemy import select, update
+
+from app.core.config import settings
+from app.db.models import Announcement, User
+from app.db.session import AsyncSessionLocal
+from app.services.notifications import drop_push_subscriptions, load_push_subscriptions, send_to_subscriptions
+from app.services.push import is_push_enabled
+from app.services.realtime import realtime_hub
+
+
+def announcement_event(announcement: Announcement) -> dict:
+    return {
+        "type": "announcement",
+        "id": str(announcement.id),
+        "title": announcement.title,
+        "text": announcement.text,
+        "created_at": announcement.created_at.isoformat() if announcement.created_at else "",
+    }
+
+
+class AnnouncementSender:
+    # Fans an announcement out to every active user in chunks of ANNOUNCEMENT_CHUNK_SIZE, pausing
+    # between chunks. Progress is committed after each chunk, so a restart resumes from the cursor;
+    # a chunk interrupted mid-way may be delivered twice, never skipped.
+    def __init__(self) -> None:
+        self._tasks: dict[UUID, asyncio.Task] = {}
+
+    async def start(self) -> None:
+        async with AsyncSessionLocal() as db:
+            pending = (
+                await db.scalars(select(Announcement.id).where(Announcement.status.in_(["pending", "sending"])))
+            ).all()
+        for announcement_id in pending:
+            self.schedule(announcement_id)
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def schedule(self, announcement_id: UUID) -> None:
+        if announcement_id not in self._tasks:
+            self._tasks[announcement_id] = asyncio.create_task(self._deliver(announcement_id))
+
+    async def _deliver(self, announcement_id: UUID) -> None:
+        try:
+            while await self._deliver_chunk(announcement_id):
+                await asyncio.sleep(settings.announcement_chunk_interval_seconds)
+        finally:
+            self._tasks.pop(announcement_id, None)
+
+    async def _deliver_chunk(self, announcement_id: UUID) -> bool:
+        # The session is closed while the chunk is pushed: web pushes go out one by one over blocking
+        # HTTP and would hold a pool connection for the whole chunk.
+        async with AsyncSessionLocal() as db:
+            announcement = await db.get(Announcement, announcement_id)
+            if announcement is None or announcement.status == "done":
+                return False
+
+            stmt = (
+                select(User.id, User.login)
+                .where(User.is_blocked.is_(False))
+                .order_by(User.id)
+                .limit(settings.announcement_chunk_size)
+            )
+            if announcement.cursor_user_id is not None:
+                stmt = stmt.where(User.id > announcement.cursor_user_id)
+            rows = (await db.execute(stmt)).all()
+            if not rows:
+                announcement.status = "done"
+                announcement.finished_at = datetime.now(timezone.utc)
+                await db.commit()
+                return False
+
+            event = announcement_event(announcement)
+            push_payload = {
+                "title": announcement.title,
+                "body": announcement.text[:200],
+                "data": {"type": "announcement", "id": str(announcement.id)},
+            }
+            # Users online on a socket get the event instead of a push.
+            offline = [user_id for user_id, login in rows if not realtime_hub.has_event_connection(login)]
+            subscriptions = await load_push_subscriptions(db, offline) if is_push_enabled() and offline else []
+
+        await realtime_hub.notify_users([login for _, login in rows], event)
+        stale_ids = await send_to_subscriptions(subscriptions, push_payload)
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Announcement)
+                .where(Announcement.id == announcement_id)
+                .values(
+                    status="sending",
+                    cursor_user_id=rows[-1][0],
+                    delivered_count=Announcement.delivered_count + len(rows),
+                )
+            )
+            await db.commit()
+            await drop_push_subscriptions(db, stale_ids)
+        return True
+
+
+announcement_sender = AnnouncementSender()
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+from collections import deque
+from uuid import UUID
+
+from fastapi import WebSocket
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import User
+from app.services.groups import group_members_cache
+from app.services.realtime import PING_EVENT, close_quietly, encode_event
+
+
+def private_room_id(a: str, b: str) -> str:
+    return "__".join(sorted([a, b]))
+
+
+class CallPeer:
+    def __init__(self, ws: WebSocket, login: str, *, batch: bool = False) -> None:
+        self.ws = ws
+        self.login = login
+        self.batch = batch
+        self.pending: deque = deque()
+        self.ready = asyncio.Event()
+        self.writer: asyncio.Task | None = None
+
+
+class CallRoom:
+    def __init__(self, room_id: str) -> None:
+        self.room_id = room_id
+        self.peers: dict[WebSocket, CallPeer] = {}
+        self.last_activity = time.monotonic()
+
+
+class CallRegistry:
+    # Signaling rooms for WebRTC calls. Every peer has its own outbound queue and writer task, so a
+    # slow peer does not hold up the others; consecutive ICE candidates queued for a peer that
+    # joined with ?batch=1 go out as one {"type": "ice", "candidates": [...]} frame.
+    def __init__(self) -> None:
+        self._rooms: dict[str, CallRoom] = {}
+        self._invites: dict[str, float] = {}
+        self._sweeper: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        await asyncio.gather(self._sweeper, return_exceptions=True)
+        self._sweeper = None
+
+    def room_count(self) -> int:
+        return len(self._rooms)
+
+    def peer_count(self) -> int:
+        return sum(len(room.peers) for room in self._rooms.values())
+
+    def invite(self, room_id: str) -> None:
+        self._invites[room_id] = time.monotonic() + settings.call_invite_ttl_seconds
+
+    async def authorize(self, db: AsyncSession, room_id: str, user: User) -> bool:
+        if room_id.startswith("group__"):
+            try:
+                group_id = UUID(room_id.removeprefix("group__"))
+            except ValueError:
+                return False
+            return await group_members_cache.is_member(db, group_id, user.id)
+
+        pair = room_id.split("__")
+        if len(pair) != 2 or user.login not in pair or private_room_id(*pair) != room_id:
+            return False
+        # A private room opens only after /calls/invite for the pair and stays open while anyone is in it.
+        room = self._rooms.get(room_id)
+        return bool(room and room.peers) or self._invites.get(room_id, 0.0) > time.monotonic()
+
+    def join(self, room_id: str, ws: WebSocket, login: str, *, batch: bool = False) -> bool:
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = CallRoom(room_id)
+        if len(room.peers) >= settings.call_room_max_peers:
+            if not room.peers:
+                self._rooms.pop(room_id, None)
+            return False
+        peer = room.peers[ws] = CallPeer(ws, login, batch=batch)
+        peer.writer = asyncio.create_task(self._write(room, peer))
+        room.last_activity = time.monotonic()
+        return True
+
+    def leave(self, room_id: str, ws: WebSocket) -> None:
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        peer = room.peers.pop(ws, None)
+        if peer and peer.writer and peer.writer is not asyncio.current_task():
+            peer.writer.cancel()
+        if not room.peers:
+            # The invite outlives the room: a caller whose socket dropped before the answer can rejoin
+            # until it expires or someone hangs up.
+            self._rooms.pop(room_id, None)
+
+    def relay(self, room_id: str, sender: WebSocket, message: str) -> None:
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        room.last_activity = time.monotonic()
+        frame: object = message
+        try:
+            parsed = json.loads(message)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict) and parsed.get("type") == "ice" and "candidate" in parsed:
+            frame = parsed
+        elif isinstance(parsed, dict) and parsed.get("type") == "hangup":
+            self._invites.pop(room_id, None)
+        for ws, peer in list(room.peers.items()):
+            if ws is sender:
+                continue
+            self._enqueue(room, peer, frame)
+
+    def _enqueue(self, room: CallRoom, peer: CallPeer, frame: object) -> None:
+        if len(peer.pending) >= settings.call_peer_queue_size:
+            # The peer is not draining its socket; drop it rather than buffer without bound.
+            self.leave(room.room_id, peer.ws)
+            asyncio.create_task(close_quietly(peer.ws, 1013))
+            return
+        peer.pending.append(frame)
+        peer.ready.set()
+
+    async def _write(self, room: CallRoom, peer: CallPeer) -> None:
+        try:
+            while True:
+                if not peer.pending:
+                    peer.ready.clear()
+                    await peer.ready.wait()
+                    continue
+                frame = peer.pending.popleft()
+                if isinstance(frame, dict):
+                    candidates = [frame["candidate"]]
+                    if peer.batch:
+                        await asyncio.sleep(settings.call_ice_batch_ms / 1000)
+                        # Only candidates directly behind this one are merged so frame order is kept.
+                        while peer.pending and isinstance(peer.pending[0], dict):
+                            candidates.append(peer.pending.popleft()["candidate"])
+                        text = json.dumps({"type": "ice", "candidates": candidates}, ensure_ascii=False)
+                    else:
+                        text = json.dumps(frame, ensure_ascii=False)
+                else:
+                    text = frame
+                await asyncio.wait_for(peer.ws.send_text(text), timeout=settings.ws_ping_interval_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.leave(room.room_id, peer.ws)
+            await close_quietly(peer.ws, 1001)
+
+    async def _sweep(self) -> None:
+        # Pings go through the peer queues so they never interleave with a relay in progress.
+        ping = encode_event(PING_EVENT)
+        while True:
+            await asyncio.sleep(settings.ws_ping_interval_seconds)
+            now = time.monotonic()
+            self._invites = {room_id: expires for room_id, expires in self._invites.items() if expires > now}
+            for room in list(self._rooms.values()):
+                # A room nobody else joined within the idle timeout is an abandoned ring.
+                if len(room.peers) < 2 and now - room.last_activity > settings.call_room_idle_seconds:
+                    for ws in list(room.peers):
+                        self.leave(room.room_id, ws)
+                        asyncio.create_task(close_quietly(ws, 1000))
+                    continue
+                for peer in list(room.peers.values()):
+                    self._enqueue(room, peer, ping)
+
+
+call_registry = CallRegistry()
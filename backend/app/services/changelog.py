@@ -0,0 +1,194 @@
+import asyncio
+import base64
+import logging
+from collections.abc import Iterable
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import ChangeLog, Message
+from app.db.session import AsyncSessionLocal
+from app.db.types import snapshot_xmin
+
+
+logger = logging.getLogger(__name__)
+
+# Log position: (writing transaction id, row id). Ids are taken at insert time but become visible at
+# commit, so a reader going by id alone could pass an id that is still in flight and skip it for
+# good. Readers only go up to the oldest running transaction instead: nothing can appear below it
+# any more, and writers never wait on each other.
+ChangeKey = tuple[int, int]
+
+
+def change_key():
+    return tuple_(ChangeLog.xid, ChangeLog.id)
+
+
+def encode_cursor(key: ChangeKey) -> str:
+    return base64.urlsafe_b64encode(f"c2:{key[0]}:{key[1]}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> ChangeKey:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        version, _, rest = raw.partition(":")
+        if version == "c1":
+            # Issued before xid existed; those rows were given xid 0.
+            return 0, int(rest)
+        if version != "c2":
+            raise ValueError(cursor)
+        xid, change_id = rest.split(":")
+        return int(xid), int(change_id)
+    except Exception as exc:
+        raise ValueError(cursor) from exc
+
+
+def visible_changes():
+    # Changes of finished transactions only; see ChangeKey.
+    return ChangeLog.xid < snapshot_xmin()
+
+
+def message_changes(
+    kind: str,
+    message_id: UUID,
+    sender_id: UUID,
+    receiver_user_id: UUID | None,
+    group_id: UUID | None,
+) -> list[dict]:
+    if group_id:
+        return [
+            {"kind": kind, "group_id": group_id, "chat_type": "group", "target": str(group_id), "message_id": message_id}
+        ]
+    rows = [
+        {
+            "kind": kind,
+            "user_id": sender_id,
+            "chat_type": "private",
+            "target": str(receiver_user_id),
+            "message_id": message_id,
+        }
+    ]
+    if receiver_user_id and receiver_user_id != sender_id:
+        rows.append(
+            {"kind": kind, "user_id": receiver_user_id, "chat_type": "private", "target": str(sender_id), "message_id": message_id}
+        )
+    return rows
+
+
+async def record_changes(db: AsyncSession, rows: list[dict]) -> None:
+    # Written in the caller's transaction, so a change is logged exactly when it commits.
+    if rows:
+        # executemany needs the same keys in every row.
+        defaults = {"user_id": None, "group_id": None, "message_id": None, "data": None}
+        await db.execute(insert(ChangeLog), [{**defaults, **row} for row in rows])
+
+
+async def record_message_change(db: AsyncSession, kind: str, msg: Message) -> None:
+    if msg.id is None:
+        await db.flush()
+    await record_changes(db, message_changes(kind, msg.id, msg.sender_id, msg.receiver_user_id, msg.group_id))
+
+
+async def record_read(
+    db: AsyncSession, reader_id: UUID, reader_login: str, *, partner_id: UUID | None = None, group_id: UUID | None = None
+) -> None:
+    data = {"reader": reader_login}
+    if group_id:
+        rows = [{"kind": "chat.read", "group_id": group_id, "chat_type": "group", "target": str(group_id), "data": data}]
+    else:
+        rows = [
+            {"kind": "chat.read", "user_id": reader_id, "chat_type": "private", "target": str(partner_id), "data": data},
+            {"kind": "chat.read", "user_id": partner_id, "chat_type": "private", "target": str(reader_id), "data": data},
+        ]
+    await record_changes(db, rows)
+
+
+async def record_group_change(
+    db: AsyncSession,
+    group_id: UUID,
+    *,
+    added: Iterable[UUID] = (),
+    removed: Iterable[UUID] = (),
+    deleted: bool = False,
+) -> None:
+    target = str(group_id)
+    rows: list[dict] = []
+    if not deleted:
+        rows.append({"kind": "group.updated", "group_id": group_id, "chat_type": "group", "target": target})
+    # Joins and leaves are logged per user: a removed member can no longer read the group's own rows.
+    rows.extend({"kind": "group.joined", "user_id": uid, "chat_type": "group", "target": target} for uid in added)
+    left_kind = "group.deleted" if deleted else "group.left"
+    rows.extend({"kind": left_kind, "user_id": uid, "chat_type": "group", "target": target} for uid in removed)
+    await record_changes(db, rows)
+
+
+# Pruning turns the newest pruned row into this marker, so readers can tell a cursor that missed
+# pruned rows from one that simply predates the first change. Markers belong to no user or group.
+PRUNED_KIND = "log.pruned"
+
+
+async def _edge_row(db: AsyncSession, *where, newest: bool):
+    order = (ChangeLog.xid.desc(), ChangeLog.id.desc()) if newest else (ChangeLog.xid, ChangeLog.id)
+    stmt = select(ChangeLog.xid, ChangeLog.id, ChangeLog.kind).where(*where).order_by(*order).limit(1)
+    return (await db.execute(stmt)).first()
+
+
+async def head_key(db: AsyncSession) -> ChangeKey:
+    row = await _edge_row(db, visible_changes(), newest=True)
+    return (row.xid, row.id) if row else (0, 0)
+
+
+async def pruned_through(db: AsyncSession) -> ChangeKey | None:
+    # Key of the last pruned row; a cursor below it has missed changes.
+    row = await _edge_row(db, newest=False)
+    return (row.xid, row.id) if row and row.kind == PRUNED_KIND else None
+
+
+async def prune_changes(db: AsyncSession) -> int:
+    # Drops every row older than the retention window and leaves a marker in place of the newest
+    # of them. The retained log stays a contiguous tail in key order.
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.sync_retention_days)
+    boundary = await _edge_row(db, ChangeLog.created_at < cutoff, visible_changes(), newest=True)
+    if boundary is None:
+        return 0
+    result = await db.execute(delete(ChangeLog).where(change_key() < tuple_(boundary.xid, boundary.id)))
+    await db.execute(
+        update(ChangeLog)
+        .where(ChangeLog.id == boundary.id)
+        .values(kind=PRUNED_KIND, user_id=None, group_id=None, message_id=None, data=None)
+    )
+    await db.commit()
+    return result.rowcount or 0
+
+
+class ChangeLogPruner:
+    def __init__(self) -> None:
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None and settings.sync_retention_days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    pruned = await prune_changes(db)
+                if pruned:
+                    logger.info("Pruned %s change log rows", pruned)
+            except Exception:
+                logger.exception("Change log pruning failed")
+            await asyncio.sleep(settings.sync_prune_interval_seconds)
+
+
+change_log_pruner = ChangeLogPruner()
@@ -0,0 +1,170 @@
+from uuid import UUID
+
+from sqlalchemy import and_, func, or_, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.db.models import ChatGroup, Message, User
+from app.schemas.chat import GroupShort, UserShort
+from app.services.groups import group_members_cache
+from app.services.utils import build_display_name, build_message_preview
+
+
+def _last_time(msg: Message | None) -> str:
+    return msg.created_at.strftime("%H:%M") if msg and msg.created_at else ""
+
+
+class GroupChatSummary:
+    # Loaded once per event; for_user() only patches the per-recipient fields.
+    def __init__(
+        self, group: ChatGroup, owner_login: str, members: dict[UUID, str], last: Message | None, unread: dict[UUID, int]
+    ) -> None:
+        self.members = members
+        self.last = last
+        self.unread = unread
+        self.unread_total = sum(unread.values())
+        self.base = GroupShort(
+            id=group.id,
+            name=group.name,
+            avatar_url=group.avatar_url,
+            owner_login=owner_login,
+            members=[],
+            last_time=_last_time(last),
+        ).model_dump(mode="json")
+        self.base["members_count"] = len(members)
+        self._entries: dict[tuple, dict] = {}
+
+    def for_user(self, user_id: UUID | None, *, with_members: bool = False) -> dict | None:
+        if user_id not in self.members:
+            return None
+        is_last_sender = bool(self.last and self.last.sender_id == user_id)
+        unread = self.unread_total - self.unread.get(user_id, 0)
+        # Recipients with identical fields share one dict, so the hub encodes it once.
+        key = (is_last_sender, unread, with_members)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {
+                **self.base,
+                "unread_count": unread,
+                "last_message": build_message_preview(self.last, user_id) if self.last else "",
+            }
+            if with_members:
+                entry["members"] = list(self.members.values())
+            else:
+                entry.pop("members")
+            self._entries[key] = entry
+        return entry
+
+
+class PrivateChatSummary:
+    def __init__(self, users: dict[UUID, User], last: Message | None, unread: dict[UUID, int]) -> None:
+        self.users = users
+        self.last = last
+        self.unread = unread
+
+    def for_user(self, user_id: UUID | None, **_) -> dict | None:
+        if user_id not in self.users:
+            return None
+        partner = next((u for uid, u in self.users.items() if uid != user_id), self.users[user_id])
+        if partner.is_blocked:
+            return None
+        return UserShort(
+            id=partner.id,
+            login=partner.login,
+            name=build_display_name(partner),
+            avatar_url=partner.avatar_url,
+            phone=partner.phone,
+            email=partner.email,
+            position=partner.position,
+            unread_count=self.unread.get(partner.id, 0),
+            last_message=build_message_preview(self.last, user_id) if self.last else "",
+            last_time=_last_time(self.last),
+        ).model_dump(mode="json")
+
+
+def _last_message_id(*where):
+    return select(Message.id).where(*where).order_by(Message.created_at.desc()).limit(1).scalar_subquery()
+
+
+def _unread_count(*where):
+    return select(func.count(Message.id)).where(Message.is_read.is_(False), *where).scalar_subquery()
+
+
+async def load_group_summary(db: AsyncSession, group_id: UUID) -> GroupChatSummary | None:
+    # Runs for every group event before fan-out, so the group, its owner, the last message and the
+    # unread counts per sender come back in one statement: one row per sender with unread messages,
+    # or a single row with NULLs when there are none.
+    owner = aliased(User)
+    unread = (
+        select(Message.sender_id, func.count(Message.id).label("unread"))
+        .where(Message.group_id == group_id, Message.is_read.is_(False))
+        .group_by(Message.sender_id)
+        .subquery()
+    )
+    rows = (
+        await db.execute(
+            select(ChatGroup, owner.login, Message, unread.c.sender_id, unread.c.unread)
+            .join(owner, owner.id == ChatGroup.owner_id)
+            .outerjoin(Message, Message.id == _last_message_id(Message.group_id == group_id))
+            .outerjoin(unread, true())
+            .where(ChatGroup.id == group_id)
+        )
+    ).all()
+    if not rows:
+        return None
+    group, owner_login, last = rows[0][0], rows[0][1], rows[0][2]
+    members = await group_members_cache.members(db, group_id)
+    counts = {sender_id: int(count) for *_, sender_id, count in rows if sender_id is not None}
+    return GroupChatSummary(group, owner_login, members, last, counts)
+
+
+async def load_private_summary(db: AsyncSession, logins: list[str]) -> PrivateChatSummary | None:
+    users = (await db.scalars(select(User).where(User.login.in_(set(logins))))).all()
+    if not users:
+        return None
+    ids = [u.id for u in users]
+    a, b = ids[0], ids[-1]
+    pair = or_(
+        and_(Message.sender_id == a, Message.receiver_user_id == b),
+        and_(Message.sender_id == b, Message.receiver_user_id == a),
+    )
+    # No row means no messages, and then nothing is unread either.
+    row = (
+        await db.execute(
+            select(
+                Message,
+                _unread_count(Message.group_id.is_(None), Message.sender_id == a, Message.receiver_user_id == b),
+                _unread_count(Message.group_id.is_(None), Message.sender_id == b, Message.receiver_user_id == a),
+            ).where(Message.id == _last_message_id(Message.group_id.is_(None), pair))
+        )
+    ).first()
+    last, unread = None, {}
+    if row is not None:
+        last, unread = row[0], {a: int(row[1]), b: int(row[2])}
+    return PrivateChatSummary({u.id: u for u in users}, last, unread)
+
+
+async def build_chat_entries(
+    db: AsyncSession,
+    chat_type: str,
+    target: str,
+    recipients: list[str],
+    *,
+    with_members: set[str] | None = None,
+) -> dict[str, dict | None]:
+    with_members = with_members or set()
+    if chat_type == "group":
+        try:
+            summary = await load_group_summary(db, UUID(target))
+        except ValueError:
+            summary = None
+        if summary is None:
+            return {login: None for login in recipients}
+        ids = {login: uid for uid, login in summary.members.items()}
+    else:
+        # Private events always go to exactly the two participants.
+        summary = await load_private_summary(db, recipients)
+        if summary is None:
+            return {login: None for login in recipients}
+        ids = {u.login: uid for uid, u in summary.users.items()}
+    return {login: summary.for_user(ids.get(login), with_members=login in with_members) for login in recipients}
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from app.core.config import settings
+from app.services.metrics import EVENT_HANDLER_LATENCY, EVENT_HANDLER_QUERIES, RequestQueries, request_queries
+
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+class EventDispatcher:
+    def __init__(self) -> None:
+        self._handlers: dict[str, list[EventHandler]] = defaultdict(list)
+        self._queues: list[asyncio.Queue] = []
+        self._workers: list[asyncio.Task] = []
+
+    def subscribe(self, event_type: str, handler: EventHandler) -> None:
+        if handler not in self._handlers[event_type]:
+            self._handlers[event_type].append(handler)
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        for _ in range(max(1, settings.event_workers)):
+            queue: asyncio.Queue = asyncio.Queue(maxsize=settings.event_queue_size)
+            self._queues.append(queue)
+            self._workers.append(asyncio.create_task(self._run_worker(queue)))
+
+    async def stop(self) -> None:
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout=settings.event_drain_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("Event queues not drained on shutdown")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def publish(self, event_type: str, data: dict[str, Any], *, key: str = "") -> None:
+        if not self._workers:
+            await self._deliver(event_type, data)
+            return
+        # Events with the same key go to the same worker, so per-chat order is preserved.
+        queue = self._queues[zlib.crc32(key.encode("utf-8")) % len(self._queues)]
+        await queue.put((event_type, data))
+
+    async def _run_worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            event_type, data = await queue.get()
+            try:
+                await self._deliver(event_type, data)
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, event_type: str, data: dict[str, Any]) -> None:
+        for handler in self._handlers.get(event_type, []):
+            # Handlers are charged the same query budget as a request; their SQL runs before fan-out.
+            queries = RequestQueries({"route_path": f"event:{event_type}"})
+            token = request_queries.set(queries)
+            start = time.perf_counter()
+            try:
+                await handler(data)
+            except Exception:
+                logger.exception("Event handler failed for %s", event_type)
+            finally:
+                request_queries.reset(token)
+                queries.closed = True
+                EVENT_HANDLER_LATENCY.labels(event_type).observe(time.perf_counter() - start)
+                EVENT_HANDLER_QUERIES.labels(event_type).observe(queries.count)
+                if settings.query_budget and queries.count > settings.query_budget:
+                    logger.warning(
+                        "Event %s ran %d queries in %.1f ms (budget %d): %s",
+                        event_type,
+                        queries.count,
+                        queries.seconds * 1000,
+                        settings.query_budget,
+                        "; ".join(f"{count}x {text}" for text, count in queries.top()),
+                    )
+
+
+event_dispatcher = EventDispatcher()
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import GroupMember, User
+from app.services.invalidation import invalidation_bus
+
+
+class GroupMembershipCache:
+    def __init__(self) -> None:
+        self._members: OrderedDict[UUID, tuple[float, dict[UUID, str]]] = OrderedDict()
+        self._generation = 0
+        invalidation_bus.subscribe("group", self._on_invalidation)
+
+    async def members(self, db: AsyncSession, group_id: UUID) -> dict[UUID, str]:
+        entry = self._members.get(group_id)
+        if entry and entry[0] > time.monotonic():
+            self._members.move_to_end(group_id)
+            return entry[1]
+
+        generation = self._generation
+        rows = (
+            await db.execute(
+                select(GroupMember.user_id, User.login)
+                .join(User, User.id == GroupMember.user_id)
+                .where(GroupMember.group_id == group_id)
+            )
+        ).all()
+        members = {user_id: login for user_id, login in rows}
+        # Do not store a result that may have been loaded before a concurrent invalidation.
+        if generation == self._generation:
+            self._members[group_id] = (time.monotonic() + settings.group_cache_ttl_seconds, members)
+            self._members.move_to_end(group_id)
+            while len(self._members) > settings.group_cache_max_groups:
+                self._members.popitem(last=False)
+        return members
+
+    async def is_member(self, db: AsyncSession, group_id: UUID, user_id: UUID) -> bool:
+        return user_id in await self.members(db, group_id)
+
+    async def member_logins(self, db: AsyncSession, group_id: UUID) -> list[str]:
+        return list((await self.members(db, group_id)).values())
+
+    def invalidate(self, group_id: UUID | None = None) -> None:
+        self._generation += 1
+        if group_id is None:
+            self._members.clear()
+        else:
+            self._members.pop(group_id, None)
+
+    async def publish_invalidation(self, db: AsyncSession, group_id: UUID | None = None) -> None:
+        await invalidation_bus.publish(db, "group", str(group_id) if group_id else "*")
+
+    def _on_invalidation(self, key: str) -> None:
+        if key == "*":
+            self.invalidate()
+            return
+        try:
+            self.invalidate(UUID(key))
+        except ValueError:
+            self.invalidate()
+
+
+group_members_cache = GroupMembershipCache()
+
+
+async def sync_group_members(
+    db: AsyncSession, group_id: UUID, user_ids: set[UUID], *, remove_missing: bool = True
+) -> tuple[set[UUID], set[UUID]]:
+    current = set((await db.scalars(select(GroupMember.user_id).where(GroupMember.group_id == group_id))).all())
+    added = user_ids - current
+    removed = current - user_ids if remove_missing else set()
+    if added:
+        await db.execute(insert(GroupMember), [{"group_id": group_id, "user_id": uid} for uid in added])
+    if removed:
+        await db.execute(
+            delete(GroupMember).where(GroupMember.group_id == group_id, GroupMember.user_id.in_(removed))
+        )
+    return added, removed
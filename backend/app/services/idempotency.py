@@ -0,0 +1,58 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from app.core.config import settings
+
+
+class RecentResults:
+    # Short-lived (scope, key) -> result records. A replayed key gets the stored
+    # result; a duplicate arriving while the first is still running awaits it.
+    def __init__(self, max_entries: int = 50000) -> None:
+        self._results: OrderedDict[tuple[str, str], tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+        self._max_entries = max_entries
+
+    def get(self, scope: str, key: str) -> tuple[bool, Any]:
+        entry = self._results.get((scope, key))
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            self._results.pop((scope, key), None)
+            return False, None
+        return True, entry[1]
+
+    def put(self, scope: str, key: str, result: Any) -> None:
+        self._results[(scope, key)] = (time.monotonic() + settings.idempotency_ttl_seconds, result)
+        self._results.move_to_end((scope, key))
+        while len(self._results) > self._max_entries:
+            self._results.popitem(last=False)
+
+    async def run(self, scope: str, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        found, result = self.get(scope, key)
+        if found:
+            return result
+        inflight = self._inflight.get((scope, key))
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[(scope, key)] = future
+        try:
+            result = await factory()
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Nobody may be waiting; mark the exception as retrieved.
+            future.exception()
+            raise
+        else:
+            self.put(scope, key, result)
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop((scope, key), None)
+
+
+recent_results = RecentResults()
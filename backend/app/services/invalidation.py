@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from collections import defaultdict
+from collections.abc import Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import engine
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "mg_invalidate"
+
+InvalidationCallback = Callable[[str], None]
+
+
+class InvalidationBus:
+    # Cross-worker cache invalidation over Postgres LISTEN/NOTIFY. Notifications are
+    # issued inside the writer's transaction, so other workers only see them on commit.
+    def __init__(self) -> None:
+        self._callbacks: dict[str, list[InvalidationCallback]] = defaultdict(list)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return engine.dialect.name == "postgresql"
+
+    def subscribe(self, topic: str, callback: InvalidationCallback) -> None:
+        if callback not in self._callbacks[topic]:
+            self._callbacks[topic].append(callback)
+
+    async def publish(self, db: AsyncSession, topic: str, key: str) -> None:
+        if not self.enabled:
+            return
+        await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": f"{topic}:{key}"})
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def _dispatch(self, topic: str, key: str) -> None:
+        for callback in self._callbacks.get(topic, []):
+            try:
+                callback(key)
+            except Exception:
+                logger.exception("Invalidation callback failed for %s", topic)
+
+    def _on_notify(self, _connection, _pid, _channel, payload: str) -> None:
+        topic, _, key = payload.partition(":")
+        self._dispatch(topic, key)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    driver = raw.driver_connection
+                    closed = asyncio.Event()
+                    driver.add_termination_listener(lambda _c: closed.set())
+                    await driver.add_listener(CHANNEL, self._on_notify)
+                    # Anything published while we were not listening is lost; start clean.
+                    for topic in list(self._callbacks):
+                        self._dispatch(topic, "*")
+                    await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Invalidation listener failed, reconnecting")
+            await asyncio.sleep(5)
+
+
+invalidation_bus = InvalidationBus()
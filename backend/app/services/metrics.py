@@ -0,0 +1,200 @@
+import logging
+import re
+import time
+from collections import Counter as Tally
+from collections.abc import Callable
+from contextvars import ContextVar
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram(
+    "mg_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+EVENT_FANOUT = Histogram(
+    "mg_event_fanout_recipients",
+    "Recipients of one realtime event",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+)
+PUSH_SENT = Counter("mg_push_sent_total", "Web push deliveries by outcome", ["outcome"])
+for _outcome in ("delivered", "expired", "failed"):
+    PUSH_SENT.labels(_outcome)
+DB_QUERY_LATENCY = Histogram(
+    "mg_db_query_duration_seconds",
+    "SQL statement execution time",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_HANDLER_LATENCY = Histogram(
+    "mg_event_handler_duration_seconds",
+    "Time one event handler took, including its SQL and fan-out",
+    ["event"],
+)
+EVENT_HANDLER_QUERIES = Histogram(
+    "mg_event_handler_queries",
+    "SQL statements run by one event handler",
+    ["event"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+REQUEST_QUERIES = Histogram(
+    "mg_http_request_queries",
+    "SQL statements run by one HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+
+
+class StateGauges:
+    # Gauges read from live service state at scrape time, so the hot paths pay nothing for them.
+    def __init__(self) -> None:
+        self._gauges: list[tuple[str, str, Callable[[], float]]] = []
+
+    def add(self, name: str, documentation: str, read: Callable[[], float]) -> None:
+        self._gauges.append((name, documentation, read))
+
+    def collect(self):
+        for name, documentation, read in self._gauges:
+            yield GaugeMetricFamily(name, documentation, value=read())
+
+    def describe(self):
+        # Registering must not call the readers: the services may not be ready yet.
+        return []
+
+
+state_gauges = StateGauges()
+REGISTRY.register(state_gauges)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class RequestQueries:
+    # SQL run on behalf of one HTTP request. Tasks spawned by the request inherit it through the
+    # context; once the request is done it is closed, so their queries are not charged to it.
+    def __init__(self, scope: dict) -> None:
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Tally[str] = Tally()
+        self.closed = False
+
+    def route_path(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("route_path", "unmatched")
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries"'
+
+    def top(self, limit: int = 5) -> list[tuple[str, int]]:
+        fingerprints: Tally[str] = Tally()
+        for statement, count in self.statements.items():
+            fingerprints[fingerprint(statement)] += count
+        return fingerprints.most_common(limit)
+
+
+request_queries: ContextVar[RequestQueries | None] = ContextVar("request_queries", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b|\$\d+|\?|%\(\w+\)s")
+_IN_LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    # Statements that differ only in literals, placeholders or IN-list length share a fingerprint.
+    text = _LITERALS.sub("?", _SPACES.sub(" ", statement).strip())
+    return _IN_LISTS.sub("(?)", text)[:300]
+
+
+def current_queries() -> RequestQueries | None:
+    queries = request_queries.get()
+    return None if queries is None or queries.closed else queries
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    pool = engine.pool
+    if hasattr(pool, "checkedout"):
+        state_gauges.add("mg_db_pool_checked_out", "Connections in use", pool.checkedout)
+        state_gauges.add("mg_db_pool_idle", "Idle connections in the pool", pool.checkedin)
+        state_gauges.add("mg_db_pool_overflow", "Connections above the pool size", lambda: max(pool.overflow(), 0))
+
+    # A stack per connection: a statement that fails is popped by handle_error, so starts never pile up.
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, _cursor, statement, _parameters, _context, _executemany) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+        queries = current_queries()
+        if queries is not None:
+            queries.count += 1
+            queries.statements[statement] += 1
+            if settings.query_budget_strict and settings.query_budget and queries.count > settings.query_budget:
+                raise QueryBudgetExceeded(
+                    f"Query budget of {settings.query_budget} exceeded: {fingerprint(statement)}"
+                )
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_LATENCY.observe(elapsed)
+        queries = current_queries()
+        if queries is not None:
+            queries.seconds += elapsed
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _error(context) -> None:
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: the route template is read from the scope after routing, so
+    # /api/users/{login} is one series rather than one per user. Requests answered before
+    # routing may name their template in scope["route_path"].
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+        queries = RequestQueries(scope)
+        token = request_queries.set(queries)
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.server_timing_header:
+                    headers = [*message.get("headers", []), (b"server-timing", queries.server_timing().encode())]
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_queries.reset(token)
+            queries.closed = True
+            path = queries.route_path()
+            REQUEST_LATENCY.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
+            REQUEST_QUERIES.labels(path).observe(queries.count)
+            if settings.query_budget and queries.count > settings.query_budget:
+                logger.warning(
+                    "%s %s ran %d queries in %.1f ms (budget %d): %s",
+                    scope["method"],
+                    path,
+                    queries.count,
+                    queries.seconds * 1000,
+                    settings.query_budget,
+                    "; ".join(f"{count}x {text}" for text, count in queries.top()),
+                )
@@ -0,0 +1,297 @@
+from typing import Any
+from urllib.parse import quote_plus
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import PushSubscription, User
+from app.db.session import AsyncSessionLocal
+from app.services.chats import build_chat_entries
+from app.services.events import event_dispatcher
+from app.services.presence import presence_tracker
+from app.services.push import is_push_enabled, push_coalescer, push_topic, send_web_push
+from app.services.realtime import realtime_hub
+from app.services.typing import typing_tracker
+
+
+def chat_event_key(chat_type: str, target: str, sender_login: str = "") -> str:
+    if chat_type == "group":
+        return f"group:{target}"
+    return "private:" + "__".join(sorted([sender_login, target]))
+
+
+def _subscription_info(sub: PushSubscription) -> tuple[int, dict]:
+    # Plain data, so the pushes can be sent after the session is closed.
+    return sub.id, {"endpoint": sub.endpoint, "keys": {"p256dh": sub.p256dh, "auth": sub.auth}}
+
+
+async def load_push_subscriptions(db: AsyncSession, user_ids: list[UUID]) -> list[tuple[int, dict]]:
+    subscriptions = (await db.scalars(select(PushSubscription).where(PushSubscription.user_id.in_(user_ids)))).all()
+    return [_subscription_info(sub) for sub in subscriptions]
+
+
+async def load_push_subscriptions_by_login(db: AsyncSession, logins: list[str]) -> dict[str, list[tuple[int, dict]]]:
+    # Blocked users and users without a subscription do not come back at all.
+    rows = (
+        await db.execute(
+            select(User.login, PushSubscription)
+            .join(PushSubscription, PushSubscription.user_id == User.id)
+            .where(User.login.in_(logins), User.is_blocked.is_(False))
+        )
+    ).all()
+    result: dict[str, list[tuple[int, dict]]] = {}
+    for login, sub in rows:
+        result.setdefault(login, []).append(_subscription_info(sub))
+    return result
+
+
+async def send_to_subscriptions(
+    subscriptions: list[tuple[int, dict]], payload: dict, *, topic: str | None = None
+) -> list[int]:
+    stale_ids: list[int] = []
+    for sub_id, subscription_info in subscriptions:
+        status = await send_web_push(subscription_info, payload, topic=topic)
+        if status in (404, 410):
+            stale_ids.append(sub_id)
+    return stale_ids
+
+
+async def drop_push_subscriptions(db: AsyncSession, stale_ids: list[int]) -> None:
+    if stale_ids:
+        await db.execute(PushSubscription.__table__.delete().where(PushSubscription.id.in_(stale_ids)))
+        await db.commit()
+
+
+async def _flush_coalesced_push(chat_key: str, payloads: dict[str, dict]) -> None:
+    logins = [login for login in payloads if not realtime_hub.has_event_connection(login)]
+    if not logins:
+        return
+    async with AsyncSessionLocal() as db:
+        subscriptions = await load_push_subscriptions_by_login(db, logins)
+    stale_ids: list[int] = []
+    for login, subs in subscriptions.items():
+        stale_ids += await send_to_subscriptions(subs, payloads[login], topic=push_topic(chat_key))
+    if stale_ids:
+        async with AsyncSessionLocal() as db:
+            await drop_push_subscriptions(db, stale_ids)
+
+
+def _push_chat_key(chat_type: str, target: str, sender_login: str) -> str:
+    # Key the chat from the recipient's side: a private chat is identified by its sender.
+    return f"group:{target}" if chat_type == "group" else f"private:{sender_login}"
+
+
+async def send_push_to_logins(
+    db: AsyncSession,
+    target_logins: list[str],
+    *,
+    title: str,
+    body: str,
+    push_data: dict,
+    exclude_logins: set[str] | None = None,
+    coalesce_key: str | None = None,
+) -> None:
+    if not is_push_enabled():
+        return
+
+    exclude = exclude_logins or set()
+    filtered = [login for login in set(target_logins) if login and login not in exclude]
+    if not filtered:
+        return
+
+    # Only users who can get a push at all take part, so a large group costs one query here and no
+    # coalescing windows for members without a subscription.
+    subscriptions = await load_push_subscriptions_by_login(db, filtered)
+    # If user is online in websocket, skip web push to avoid duplicate notifications.
+    offline = [login for login in subscriptions if not realtime_hub.has_event_connection(login)]
+    payload = {"title": title, "body": body, "data": push_data}
+    if coalesce_key and offline:
+        offline = push_coalescer.admit(coalesce_key, offline, payload, _flush_coalesced_push)
+    if not offline:
+        return
+
+    stale_ids = await send_to_subscriptions(
+        [sub for login in offline for sub in subscriptions[login]],
+        payload,
+        topic=push_topic(coalesce_key) if coalesce_key else None,
+    )
+    await drop_push_subscriptions(db, stale_ids)
+
+
+def _with_chat(base: dict, entries: dict[str, dict | None]) -> dict[str, dict]:
+    payloads: dict[int, dict] = {}
+    result: dict[str, dict] = {}
+    for login, entry in entries.items():
+        payload = payloads.get(id(entry))
+        if payload is None:
+            payload = payloads[id(entry)] = {**base, "chat": entry}
+        result[login] = payload
+    return result
+
+
+async def on_message_created(event: dict[str, Any]) -> None:
+    if event["chat_type"] == "private":
+        presence_tracker.link(event["sender_login"], event["target"])
+    typing_tracker.stop(event["sender_login"], chat_event_key(event["chat_type"], event["target"], event["sender_login"]))
+    async with AsyncSessionLocal() as db:
+        entries = await build_chat_entries(db, event["chat_type"], event["target"], event["recipients"])
+        await realtime_hub.notify_each(
+            _with_chat(
+                {
+                    "type": "message:new",
+                    "chat_type": event["chat_type"],
+                    "target": event["target"],
+                    "sender_login": event["sender_login"],
+                    "sender_name": event["sender_name"],
+                    "preview": event["preview"],
+                },
+                entries,
+            )
+        )
+        title = event["sender_name"]
+        if event.get("forwarded"):
+            title = f"{title} (переслано)"
+        await send_push_to_logins(
+            db,
+            event["recipients"],
+            title=title,
+            body=event["preview"],
+            push_data={
+                "type": "message:new",
+                "chat_type": event["chat_type"],
+                "target": event["target"],
+                "sender_login": event["sender_login"],
+            },
+            exclude_logins={event["sender_login"]},
+            coalesce_key=_push_chat_key(event["chat_type"], event["target"], event["sender_login"]),
+        )
+
+
+async def on_messages_forwarded(event: dict[str, Any]) -> None:
+    # One batch forward can reach the same user through several chats. Each recipient gets a single
+    # message:new (extra chats listed under "chats") and at most one push.
+    sender_login = event["sender_login"]
+    base = {
+        "type": "message:new",
+        "sender_login": sender_login,
+        "sender_name": event["sender_name"],
+        "preview": event["preview"],
+    }
+    chats_by_login: dict[str, list[dict]] = {}
+    async with AsyncSessionLocal() as db:
+        for chat in event["chats"]:
+            if chat["chat_type"] == "private":
+                presence_tracker.link(sender_login, chat["target"])
+            entries = await build_chat_entries(db, chat["chat_type"], chat["target"], chat["recipients"])
+            for login, entry in entries.items():
+                chats_by_login.setdefault(login, []).append(
+                    {"chat_type": chat["chat_type"], "target": chat["target"], "chat": entry}
+                )
+
+        payloads: dict[str, dict] = {}
+        push_groups: dict[tuple[str, str], list[str]] = {}
+        for login, chats in chats_by_login.items():
+            payload = {**base, **chats[0]}
+            if len(chats) > 1:
+                payload["chats"] = chats
+            payloads[login] = payload
+            push_groups.setdefault((chats[0]["chat_type"], chats[0]["target"]), []).append(login)
+        await realtime_hub.notify_each(payloads)
+
+        for (chat_type, target), logins in push_groups.items():
+            await send_push_to_logins(
+                db,
+                logins,
+                title=f"{event['sender_name']} (переслано)",
+                body=event["preview"],
+                push_data={
+                    "type": "message:new",
+                    "chat_type": chat_type,
+                    "target": target,
+                    "sender_login": sender_login,
+                },
+                exclude_logins={sender_login},
+                coalesce_key=_push_chat_key(chat_type, target, sender_login),
+            )
+
+
+async def on_message_updated(event: dict[str, Any]) -> None:
+    async with AsyncSessionLocal() as db:
+        entries = await build_chat_entries(db, event["chat_type"], event["target"], event["recipients"])
+    await realtime_hub.notify_each(
+        _with_chat(
+            {
+                "type": "message:update",
+                "chat_type": event["chat_type"],
+                "target": event["target"],
+                "sender_login": event["sender_login"],
+                "sender_name": event["sender_name"],
+                "preview": event["preview"],
+            },
+            entries,
+        )
+    )
+
+
+async def on_message_deleted(event: dict[str, Any]) -> None:
+    async with AsyncSessionLocal() as db:
+        entries = await build_chat_entries(db, event["chat_type"], event["target"], event["recipients"])
+    await realtime_hub.notify_each(
+        _with_chat({"type": "message:delete", "chat_type": event["chat_type"], "target": event["target"]}, entries)
+    )
+
+
+async def on_group_changed(event: dict[str, Any]) -> None:
+    delta = event.get("delta", {})
+    async with AsyncSessionLocal() as db:
+        entries = await build_chat_entries(
+            db,
+            "group",
+            event["group_id"],
+            event["recipients"],
+            # Newly added members have no local copy of the group to patch.
+            with_members=set(delta.get("members_added", [])),
+        )
+    await realtime_hub.notify_each(
+        _with_chat({"type": "chat:update", "chat_type": "group", "target": event["group_id"], **delta}, entries)
+    )
+
+
+async def on_call_invited(event: dict[str, Any]) -> None:
+    from_login = event["from_login"]
+    from_name = event["from_name"]
+    target_login = event["target_login"]
+    async with AsyncSessionLocal() as db:
+        entries = await build_chat_entries(db, "private", target_login, [from_login, target_login])
+        await realtime_hub.notify_each(_with_chat({"type": "chat:update", "chat_type": "private"}, entries))
+        await realtime_hub.notify_users(
+            [target_login],
+            {
+                "type": "call:invite",
+                "from_login": from_login,
+                "from_name": from_name,
+            },
+        )
+        await send_push_to_logins(
+            db,
+            [target_login],
+            title="Входящий звонок",
+            body=f"{from_name} звонит вам",
+            push_data={
+                "type": "call:invite",
+                "from_login": from_login,
+                "from_name": from_name,
+                "url": f"/?incoming_call={quote_plus(from_login)}&incoming_name={quote_plus(from_name)}",
+            },
+            exclude_logins={from_login},
+        )
+
+
+def register_event_handlers() -> None:
+    event_dispatcher.subscribe("message.created", on_message_created)
+    event_dispatcher.subscribe("messages.forwarded", on_messages_forwarded)
+    event_dispatcher.subscribe("message.updated", on_message_updated)
+    event_dispatcher.subscribe("message.deleted", on_message_deleted)
+    event_dispatcher.subscribe("group.changed", on_group_changed)
+    event_dispatcher.subscribe("call.invited", on_call_invited)
@@ -0,0 +1,154 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from fastapi import WebSocket
+from sqlalchemy import bindparam, func, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import GroupMember, Message, User
+from app.db.session import AsyncSessionLocal
+from app.services.realtime import realtime_hub
+
+
+class PresenceTracker:
+    # A user is online while at least one of their event sockets is connected. Changes are sent
+    # only to online users who share a private chat or a (not too large) group with them, and are
+    # collected into one "presence" event per watcher per batch interval.
+    def __init__(self) -> None:
+        self._contacts: dict[str, set[str]] = {}
+        self._watchers: dict[str, set[str]] = defaultdict(set)
+        self._pending_offline: dict[str, asyncio.TimerHandle] = {}
+        self._changes: dict[str, datetime | None] = {}
+        self._last_seen: dict[str, datetime] = {}
+        self._flush_task: asyncio.Task | None = None
+        realtime_hub.add_presence_listener(self._on_presence)
+
+    def is_online(self, login: str) -> bool:
+        # Users inside the offline grace period still count as online.
+        return realtime_hub.has_event_connection(login) or login in self._pending_offline
+
+    async def attach(self, user: User, ws: WebSocket) -> None:
+        if user.login not in self._contacts:
+            async with AsyncSessionLocal() as db:
+                rows = await self._load_contacts(db, user)
+            if not realtime_hub.has_event_connection(user.login):
+                return
+            for login, last_seen in rows:
+                if last_seen and login not in self._last_seen:
+                    self._last_seen[login] = last_seen
+            self._watch(user.login, {login for login, _ in rows})
+
+        online: list[str] = []
+        offline: dict[str, str | None] = {}
+        for login in self._contacts.get(user.login, ()):
+            if self.is_online(login):
+                online.append(login)
+            else:
+                last_seen = self._last_seen.get(login)
+                offline[login] = last_seen.isoformat() if last_seen else None
+        await realtime_hub.reply(user.login, ws, {"type": "presence", "online": online, "offline": offline})
+
+    def link(self, a: str, b: str) -> None:
+        # New chat partners start watching each other without waiting for a reconnect.
+        for watcher, login in ((a, b), (b, a)):
+            contacts = self._contacts.get(watcher)
+            if contacts is not None and login not in contacts:
+                contacts.add(login)
+                self._watchers[login].add(watcher)
+
+    async def stop(self) -> None:
+        for handle in self._pending_offline.values():
+            handle.cancel()
+        self._pending_offline.clear()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+    async def _load_contacts(self, db: AsyncSession, user: User) -> list[tuple[str, datetime | None]]:
+        small_groups = (
+            select(GroupMember.group_id)
+            .where(GroupMember.group_id.in_(select(GroupMember.group_id).where(GroupMember.user_id == user.id)))
+            .group_by(GroupMember.group_id)
+            .having(func.count() <= settings.presence_max_group_size)
+        )
+        contact_ids = union(
+            select(Message.receiver_user_id).where(Message.sender_id == user.id, Message.group_id.is_(None)),
+            select(Message.sender_id).where(Message.receiver_user_id == user.id, Message.group_id.is_(None)),
+            select(GroupMember.user_id).where(GroupMember.group_id.in_(small_groups)),
+        ).subquery()
+        rows = await db.execute(
+            select(User.login, User.last_seen_at).where(
+                User.id.in_(select(contact_ids.c[0])), User.id != user.id, User.is_blocked.is_(False)
+            )
+        )
+        return [(login, last_seen) for login, last_seen in rows.all()]
+
+    def _watch(self, login: str, contacts: set[str]) -> None:
+        self._contacts[login] = contacts
+        for contact in contacts:
+            self._watchers[contact].add(login)
+
+    def _unwatch(self, login: str) -> None:
+        for contact in self._contacts.pop(login, ()):
+            watchers = self._watchers.get(contact)
+            if watchers is not None:
+                watchers.discard(login)
+                if not watchers:
+                    self._watchers.pop(contact, None)
+
+    def _on_presence(self, login: str, online: bool) -> None:
+        if online:
+            handle = self._pending_offline.pop(login, None)
+            if handle is not None:
+                # Reconnected within the grace period: nobody saw it leave.
+                handle.cancel()
+                return
+            self._queue(login, None)
+            return
+        self._unwatch(login)
+        self._pending_offline[login] = asyncio.get_running_loop().call_later(
+            settings.presence_offline_grace_seconds, self._went_offline, login
+        )
+
+    def _went_offline(self, login: str) -> None:
+        self._pending_offline.pop(login, None)
+        now = datetime.now(timezone.utc)
+        self._last_seen[login] = now
+        self._queue(login, now)
+
+    def _queue(self, login: str, last_seen: datetime | None) -> None:
+        self._changes[login] = last_seen
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(settings.presence_batch_interval_ms / 1000)
+        self._flush_task = None
+        changes, self._changes = self._changes, {}
+
+        payloads: dict[str, dict] = {}
+        for login, last_seen in changes.items():
+            for watcher in self._watchers.get(login, ()):
+                payload = payloads.setdefault(watcher, {"type": "presence"})
+                if last_seen is None:
+                    payload.setdefault("online", []).append(login)
+                else:
+                    payload.setdefault("offline", {})[login] = last_seen.isoformat()
+        await realtime_hub.notify_each(payloads)
+
+        seen = [{"b_login": login, "b_seen": value} for login, value in changes.items() if value is not None]
+        if seen:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    User.__table__.update()
+                    .where(User.login == bindparam("b_login"))
+                    .values(last_seen_at=bindparam("b_seen")),
+                    seen,
+                )
+                await db.commit()
+
+
+presence_tracker = PresenceTracker()
@@ -0,0 +1,131 @@
+import asyncio
+import sys
+import threading
+from collections import Counter, OrderedDict
+from collections.abc import Awaitable, Callable
+from uuid import uuid4
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # The first line of the function, not the current one, so each function is one box in the flamegraph.
+    parts = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(parts[-2:])}:{code.co_firstlineno})"
+
+
+class Sampler:
+    # Samples the stacks of every thread from a thread of its own via sys._current_frames, so the
+    # profiled code is not instrumented at all. The result is in collapsed-stack format
+    # ("thread;outer;inner count" per line), which flamegraph.pl and speedscope read directly.
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mg-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                self._stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+
+class Profiler:
+    # One process-wide profile at a time; per-request profiles are kept for a short while so an
+    # admin can fetch them by the id returned in the X-Profile-Id header.
+    def __init__(self, keep: int = 20) -> None:
+        self._busy = False
+        self._keep = keep
+        self._profiles: OrderedDict[str, str] = OrderedDict()
+
+    @property
+    def busy(self) -> bool:
+        return self._busy
+
+    def begin(self, interval: float) -> Sampler:
+        if self._busy:
+            raise RuntimeError("Profiler is already running")
+        self._busy = True
+        sampler = Sampler(interval)
+        sampler.start()
+        return sampler
+
+    def end(self, sampler: Sampler) -> str:
+        try:
+            return sampler.stop()
+        finally:
+            self._busy = False
+
+    async def profile(self, seconds: float, interval: float) -> str:
+        sampler = self.begin(interval)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile = self.end(sampler)
+        return profile
+
+    def store(self, profile_id: str, profile: str) -> None:
+        self._profiles[profile_id] = profile
+        while len(self._profiles) > self._keep:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> str | None:
+        return self._profiles.get(profile_id)
+
+
+profiler = Profiler()
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_INTERVAL_SECONDS = 0.005
+
+
+class ProfilingMiddleware:
+    # A request carrying "X-Profile: 1" from an admin is run under the sampler. The answer gets an
+    # X-Profile-Id header. The sampler sees every thread, and the event loop interleaves all other
+    # requests with this one, so the profile is of the whole process while the request ran, not of
+    # the request alone; take it on a quiet instance. Requests without the header only pay for a
+    # scan of their header list, and the admin check is skipped while a profile is running.
+    def __init__(self, app, is_admin: Callable[[dict], Awaitable[bool]]) -> None:
+        self.app = app
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send) -> None:
+        if (
+            scope["type"] != "http"
+            or not any(name == PROFILE_HEADER and value == b"1" for name, value in scope["headers"])
+            or profiler.busy
+            or not await self.is_admin(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = profiler.begin(PROFILE_INTERVAL_SECONDS)
+        profile_id = uuid4().hex
+
+        async def send_with_id(message) -> None:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.store(profile_id, profiler.end(sampler))
@@ -1,10 +1,19 @@
 import asyncio
+import base64
+import hashlib
 import json
+import logging
+import time
+from collections.abc import Awaitable, Callable
 from typing import Any
 
 from pywebpush import WebPushException, webpush
 
 from app.core.config import settings
+from app.services.metrics import PUSH_SENT
+
+
+logger = logging.getLogger(__name__)
 
 
 def is_push_enabled() -> bool:
@@ -15,27 +24,131 @@ def build_vapid_claims() -> dict[str, str]:
     return {"sub": settings.vapid_subject}
 
 
-def _send_one(subscription_info: dict[str, Any], payload_json: str) -> int | None:
+def push_topic(key: str) -> str:
+    # Topic header is limited to 32 chars of the URL-safe base64 alphabet.
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")[:32]
+
+
+def _send_one(subscription_info: dict[str, Any], payload_json: str, headers: dict[str, str]) -> int | None:
     try:
         webpush(
             subscription_info=subscription_info,
             data=payload_json,
             vapid_private_key=settings.vapid_private_key,
             vapid_claims=build_vapid_claims(),
+            headers=headers or None,
         )
+        PUSH_SENT.labels("delivered").inc()
         return None
     except WebPushException as exc:
         status_code = getattr(getattr(exc, "response", None), "status_code", None)
         if status_code in (404, 410):
+            PUSH_SENT.labels("expired").inc()
             return status_code
+        PUSH_SENT.labels("failed").inc()
         return None
     except Exception:
         # Do not break core chat/call flow if push delivery fails for any reason.
+        PUSH_SENT.labels("failed").inc()
         return None
 
 
-async def send_web_push(subscription_info: dict[str, Any], payload: dict[str, Any]) -> int | None:
+async def send_web_push(
+    subscription_info: dict[str, Any], payload: dict[str, Any], *, topic: str | None = None
+) -> int | None:
     if not is_push_enabled():
         return None
     payload_json = json.dumps(payload, ensure_ascii=False)
-    return await asyncio.to_thread(_send_one, subscription_info, payload_json)
+    headers = {"Topic": topic} if topic else {}
+    return await asyncio.to_thread(_send_one, subscription_info, payload_json, headers)
+
+
+def _plural_new_messages(count: int) -> str:
+    if count % 10 == 1 and count % 100 != 11:
+        return f"{count} новое сообщение"
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return f"{count} новых сообщения"
+    return f"{count} новых сообщений"
+
+
+CoalescedFlush = Callable[[str, dict[str, dict[str, Any]]], Awaitable[None]]
+
+
+class _CoalesceWindow:
+    def __init__(self) -> None:
+        # Per recipient: pushes folded since the last flush, pushes in the burst, when the burst began
+        # and the latest folded payload.
+        self.pending: dict[str, int] = {}
+        self.total: dict[str, int] = {}
+        self.opened: dict[str, float] = {}
+        self.payload: dict[str, dict[str, Any]] = {}
+        self.task: asyncio.Task | None = None
+
+
+class PushCoalescer:
+    # First push of a burst goes out immediately; pushes arriving while the window
+    # is open are folded into one "N new messages" push sent when it closes.
+    # There is one window and one task per chat, whatever the number of recipients, and each
+    # flush hands all of its recipients over at once. A recipient's burst ends at the first
+    # flush with nothing new for them after at least one full window.
+    def __init__(self) -> None:
+        self._windows: dict[str, _CoalesceWindow] = {}
+
+    def admit(self, chat_key: str, logins: list[str], payload: dict[str, Any], flush: CoalescedFlush) -> list[str]:
+        # Returns the recipients to push to now; the rest are folded into the window.
+        window_seconds = settings.push_coalesce_window_seconds
+        if window_seconds <= 0:
+            return logins
+
+        window = self._windows.get(chat_key)
+        if window is None:
+            window = _CoalesceWindow()
+            self._windows[chat_key] = window
+            window.task = asyncio.create_task(self._run_window(chat_key, window, window_seconds, flush))
+
+        now = time.monotonic()
+        admitted = []
+        for login in logins:
+            if login in window.total:
+                window.pending[login] = window.pending.get(login, 0) + 1
+                window.total[login] += 1
+                window.payload[login] = payload
+            else:
+                window.total[login] = 1
+                window.opened[login] = now
+                admitted.append(login)
+        return admitted
+
+    async def _run_window(
+        self, chat_key: str, window: _CoalesceWindow, window_seconds: float, flush: CoalescedFlush
+    ) -> None:
+        try:
+            while True:
+                await asyncio.sleep(window_seconds)
+                now = time.monotonic()
+                summaries = {}
+                for login in window.pending:
+                    payload, total = window.payload[login], window.total[login]
+                    summaries[login] = {
+                        "title": payload.get("title", ""),
+                        "body": _plural_new_messages(total),
+                        "data": {**payload.get("data", {}), "count": total},
+                    }
+                window.pending.clear()
+                window.payload.clear()
+                for login, opened in list(window.opened.items()):
+                    if login not in summaries and now - opened >= window_seconds:
+                        del window.opened[login], window.total[login]
+                if summaries:
+                    try:
+                        await flush(chat_key, summaries)
+                    except Exception:
+                        logger.exception("Coalesced push for %s to %s recipients failed", chat_key, len(summaries))
+                if not window.total:
+                    break
+        finally:
+            self._windows.pop(chat_key, None)
+
+
+push_coalescer = PushCoalescer()
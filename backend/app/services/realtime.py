@@ -1,54 +1,275 @@
-﻿import json
+﻿import asyncio
+import json
+import time
 from collections import defaultdict
+from collections.abc import Callable
 
 from fastapi import WebSocket
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.services.invalidation import invalidation_bus
+from app.services.metrics import EVENT_FANOUT
+
+try:
+    import msgpack
+except ImportError:  # binary event encoding is optional
+    msgpack = None
+
+
+EVENT_SUBPROTOCOLS = {"mg.json": "json", "mg.msgpack": "msgpack"}
+PING_EVENT = {"type": "ping"}
+# Application close code for a socket pushed out by a newer one of the same user; clients do not reconnect.
+WS_CLOSE_REPLACED = 4008
+
+
+def encoding_available(encoding: str) -> bool:
+    return encoding == "json" or (encoding == "msgpack" and msgpack is not None)
+
+
+def encode_event(payload: dict, encoding: str = "json") -> str | bytes:
+    if encoding == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_event_batch(encoded: list, encoding: str = "json") -> str | bytes:
+    # Events are already encoded; wrap them into one array without re-serializing.
+    if encoding == "msgpack":
+        return msgpack.Packer().pack_array_header(len(encoded)) + b"".join(encoded)
+    return "[" + ",".join(encoded) + "]"
+
+
+def decode_client_frame(message: dict) -> dict | None:
+    try:
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                return None
+            frame = msgpack.unpackb(message["bytes"], raw=False)
+        elif message.get("text") is not None:
+            frame = json.loads(message["text"])
+        else:
+            return None
+    except Exception:
+        return None
+    return frame if isinstance(frame, dict) else None
+
+
+def negotiate_event_encoding(ws: WebSocket) -> tuple[str, str | None]:
+    for subprotocol in ws.scope.get("subprotocols") or []:
+        encoding = EVENT_SUBPROTOCOLS.get(subprotocol)
+        if encoding and encoding_available(encoding):
+            return encoding, subprotocol
+    encoding = ws.query_params.get("encoding", "json")
+    return (encoding if encoding in EVENT_SUBPROTOCOLS.values() and encoding_available(encoding) else "json"), None
+
+
+class EventConnection:
+    def __init__(self, ws: WebSocket, *, batch: bool = False, encoding: str = "json") -> None:
+        self.ws = ws
+        self.batch = batch
+        self.encoding = encoding
+        self.buffer: list = []
+        self.flush_task: asyncio.Task | None = None
+        self.last_seen = time.monotonic()
+
+    async def send(self, frame: str | bytes) -> None:
+        if isinstance(frame, bytes):
+            await self.ws.send_bytes(frame)
+        else:
+            await self.ws.send_text(frame)
+
+
+async def close_quietly(ws: WebSocket, code: int) -> None:
+    try:
+        await asyncio.wait_for(ws.close(code=code), timeout=5)
+    except Exception:
+        pass
 
 
 class RealtimeHub:
     def __init__(self) -> None:
-        self._event_connections: dict[str, set[WebSocket]] = defaultdict(set)
-        self._call_rooms: dict[str, set[WebSocket]] = defaultdict(set)
+        self._event_connections: dict[str, dict[WebSocket, EventConnection]] = defaultdict(dict)
+        self._event_connection_count = 0
+        self._heartbeat_task: asyncio.Task | None = None
+        self._presence_listeners: list[Callable[[str, bool], None]] = []
+        invalidation_bus.subscribe("sockets", self._on_invalidation)
+
+    def add_presence_listener(self, callback: Callable[[str, bool], None]) -> None:
+        # Called with (login, True) when a user's first socket connects and (login, False) when the last one goes.
+        self._presence_listeners.append(callback)
+
+    def _notify_presence(self, login: str, online: bool) -> None:
+        for callback in self._presence_listeners:
+            callback(login, online)
+
+    async def start(self) -> None:
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
 
-    async def connect_events(self, login: str, ws: WebSocket) -> None:
-        await ws.accept()
-        self._event_connections[login].add(ws)
+    async def stop(self) -> None:
+        if self._heartbeat_task is None:
+            return
+        self._heartbeat_task.cancel()
+        await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+        self._heartbeat_task = None
+
+    async def connect_events(self, login: str, ws: WebSocket, *, batch: bool = False) -> bool:
+        if self._event_connection_count >= settings.ws_max_connections:
+            await ws.close(code=1013)
+            return False
+        encoding, subprotocol = negotiate_event_encoding(ws)
+        await ws.accept(subprotocol=subprotocol)
+        connections = self._event_connections[login]
+        # Over the per-user cap the oldest socket goes; it is the one most likely to be a dead tab or phone.
+        # Its own close code tells the client not to reconnect, or tabs over the cap would evict each
+        # other in a loop.
+        while len(connections) >= max(settings.ws_max_connections_per_user, 1):
+            oldest = next(iter(connections))
+            self.disconnect_events(login, oldest)
+            asyncio.create_task(close_quietly(oldest, WS_CLOSE_REPLACED))
+        first = not self._event_connections.get(login)
+        self._event_connections[login][ws] = EventConnection(ws, batch=batch, encoding=encoding)
+        self._event_connection_count += 1
+        if first:
+            self._notify_presence(login, True)
+        return True
 
     def disconnect_events(self, login: str, ws: WebSocket) -> None:
-        self._event_connections[login].discard(ws)
-        if not self._event_connections[login]:
+        connections = self._event_connections.get(login)
+        if connections is None:
+            return
+        conn = connections.pop(ws, None)
+        if conn is not None:
+            self._event_connection_count -= 1
+        if conn and conn.flush_task and conn.flush_task is not asyncio.current_task():
+            conn.flush_task.cancel()
+        if not connections:
             self._event_connections.pop(login, None)
+            if conn is not None:
+                self._notify_presence(login, False)
 
-    async def notify_users(self, logins: list[str], payload: dict) -> None:
-        msg = json.dumps(payload)
-        for login in logins:
-            sockets = list(self._event_connections.get(login, set()))
-            for ws in sockets:
-                try:
-                    await ws.send_text(msg)
-                except Exception:
+    def close_user(self, login: str, code: int = 1008) -> None:
+        # A blocked or renamed user must not keep a socket that was authorized before the change.
+        for ws in list(self._event_connections.get(login, {})):
+            self.disconnect_events(login, ws)
+            asyncio.create_task(close_quietly(ws, code))
+
+    async def publish_close_user(self, db: AsyncSession, login: str) -> None:
+        await invalidation_bus.publish(db, "sockets", login)
+
+    def _on_invalidation(self, key: str) -> None:
+        # "*" only means the listener reconnected; it is no reason to drop every socket.
+        if key != "*":
+            self.close_user(key)
+
+    def touch(self, login: str, ws: WebSocket) -> None:
+        conn = self._event_connections.get(login, {}).get(ws)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+
+    async def _heartbeat(self) -> None:
+        # Clients send a frame at least every 25s (the web app pings), so a socket silent for
+        # longer than the idle timeout is gone. The server ping makes a half-open TCP socket fail
+        # on write even before then. Call sockets are pinged by the call registry.
+        while True:
+            await asyncio.sleep(settings.ws_ping_interval_seconds)
+            try:
+                await self._ping_all()
+            except Exception:
+                pass
+
+    async def _ping_all(self) -> None:
+        deadline = time.monotonic() - settings.ws_idle_timeout_seconds
+        encoded: dict[str, str | bytes] = {}
+        pings = []
+        for login, connections in list(self._event_connections.items()):
+            for ws, conn in list(connections.items()):
+                if conn.last_seen < deadline:
                     self.disconnect_events(login, ws)
+                    asyncio.create_task(close_quietly(ws, 1001))
+                    continue
+                if conn.encoding not in encoded:
+                    encoded[conn.encoding] = encode_event(PING_EVENT, conn.encoding)
+                pings.append(self._ping_event(login, conn, encoded[conn.encoding]))
+        await asyncio.gather(*pings)
 
-    def has_event_connection(self, login: str) -> bool:
-        return bool(self._event_connections.get(login))
+    async def _ping_event(self, login: str, conn: EventConnection, msg: str | bytes) -> None:
+        try:
+            await asyncio.wait_for(conn.send(msg), timeout=settings.ws_ping_interval_seconds)
+        except Exception:
+            self.disconnect_events(login, conn.ws)
+            await close_quietly(conn.ws, 1001)
 
-    async def connect_call(self, room_id: str, ws: WebSocket) -> None:
-        await ws.accept()
-        self._call_rooms[room_id].add(ws)
+    async def reply(self, login: str, ws: WebSocket, payload: dict) -> None:
+        conn = self._event_connections.get(login, {}).get(ws)
+        if conn is None:
+            return
+        try:
+            await conn.send(encode_event(payload, conn.encoding))
+        except Exception:
+            self.disconnect_events(login, ws)
 
-    def disconnect_call(self, room_id: str, ws: WebSocket) -> None:
-        self._call_rooms[room_id].discard(ws)
-        if not self._call_rooms[room_id]:
-            self._call_rooms.pop(room_id, None)
+    async def notify_users(self, logins: list[str], payload: dict) -> None:
+        EVENT_FANOUT.observe(len(logins))
+        encoded: dict[tuple[int, str], str | bytes] = {}
+        for login in logins:
+            await self._send_event(login, payload, encoded)
+
+    async def notify_each(self, payloads: dict[str, dict]) -> None:
+        # Recipients often share the same payload object; it is encoded once per encoding.
+        EVENT_FANOUT.observe(len(payloads))
+        encoded: dict[tuple[int, str], str | bytes] = {}
+        for login, payload in payloads.items():
+            await self._send_event(login, payload, encoded)
 
-    async def broadcast_call(self, room_id: str, sender: WebSocket, message: str) -> None:
-        sockets = list(self._call_rooms.get(room_id, set()))
-        for ws in sockets:
-            if ws is sender:
+    async def _send_event(self, login: str, payload: dict, encoded: dict[tuple[int, str], str | bytes]) -> None:
+        for conn in list(self._event_connections.get(login, {}).values()):
+            key = (id(payload), conn.encoding)
+            msg = encoded.get(key)
+            if msg is None:
+                msg = encoded[key] = encode_event(payload, conn.encoding)
+            if conn.batch:
+                conn.buffer.append(msg)
+                if len(conn.buffer) >= settings.ws_batch_max_events:
+                    await self._flush(login, conn)
+                elif conn.flush_task is None:
+                    conn.flush_task = asyncio.create_task(self._flush_later(login, conn))
                 continue
             try:
-                await ws.send_text(message)
+                await conn.send(msg)
             except Exception:
-                self.disconnect_call(room_id, ws)
+                self.disconnect_events(login, conn.ws)
+
+    async def _flush_later(self, login: str, conn: EventConnection) -> None:
+        await asyncio.sleep(settings.ws_batch_interval_ms / 1000)
+        conn.flush_task = None
+        await self._flush(login, conn)
+
+    async def _flush(self, login: str, conn: EventConnection) -> None:
+        if not conn.buffer:
+            return
+        frame = encode_event_batch(conn.buffer, conn.encoding)
+        conn.buffer = []
+        try:
+            await conn.send(frame)
+        except Exception:
+            self.disconnect_events(login, conn.ws)
+
+    def connection_count(self) -> int:
+        return self._event_connection_count
+
+    def connected_users(self) -> int:
+        return len(self._event_connections)
+
+    def buffered_events(self) -> int:
+        return sum(len(conn.buffer) for connections in self._event_connections.values() for conn in connections.values())
+
+    def has_event_connection(self, login: str) -> bool:
+        # A socket that has gone quiet is treated as offline before the heartbeat gets to reap it,
+        # so its owner is not denied a push.
+        deadline = time.monotonic() - settings.ws_idle_timeout_seconds
+        return any(conn.last_seen >= deadline for conn in self._event_connections.get(login, {}).values())
 
 
 realtime_hub = RealtimeHub()
@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import logging
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.services.metrics import current_queries, request_queries
+
+
+logger = logging.getLogger(__name__)
+
+
+def redact(value: Any) -> str:
+    # Keep enough to tell what kind of value was bound, never the value itself.
+    if value is None or isinstance(value, bool):
+        return repr(value)
+    if isinstance(value, (str, bytes, list, tuple)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+_LOCKING_CLAUSE = re.compile(r"\bFOR\s+(UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b", re.IGNORECASE)
+_CALL = re.compile(r"\b([a-z_][a-z0-9_]*)\s*\(", re.IGNORECASE)
+# Keywords that may precede a parenthesis, and functions without side effects.
+_SAFE_CALLS = frozenset(
+    {
+        "all", "and", "any", "as", "exists", "from", "in", "join", "not", "on", "or", "over", "select", "values",
+        "where", "avg", "cast", "coalesce", "count", "greatest", "least", "length", "lower", "max", "min", "now",
+        "nullif", "row_number", "sum", "upper", "pg_current_snapshot", "pg_snapshot_xmin",
+    }
+)
+
+
+def can_analyze(statement: str) -> bool:
+    # EXPLAIN ANALYZE executes the statement a second time. Only plain reads may be repeated: a
+    # function call could take a lock or send a notification again, and FOR UPDATE/SHARE would
+    # lock the rows again next to the transaction that is still holding them.
+    if statement.lstrip()[:6].upper() != "SELECT" or _LOCKING_CLAUSE.search(statement):
+        return False
+    return all(name.lower() in _SAFE_CALLS for name in _CALL.findall(statement))
+
+
+class SlowQuery:
+    def __init__(self, query_id: int, statement: str, params: list[str], route: str, duration_ms: float) -> None:
+        self.id = query_id
+        self.at = datetime.now(timezone.utc)
+        self.statement = statement
+        self.params = params
+        self.route = route
+        self.duration_ms = duration_ms
+        self.plan: str | None = None
+        self.explain_error = ""
+
+
+class SlowQueryLog:
+    # Opt-in (SLOW_QUERY_MS > 0). Statements slower than the threshold go into a bounded ring buffer
+    # with redacted parameters and the route that ran them. On Postgres a slow SELECT is then
+    # explained on a connection of its own, in the background and one at a time: plain reads under
+    # EXPLAIN (ANALYZE, BUFFERS), anything else (see can_analyze) under plain EXPLAIN, which does not
+    # run it. The real parameters are only held until that plan is taken.
+    def __init__(self) -> None:
+        self._records: deque[SlowQuery] = deque(maxlen=max(settings.slow_query_log_size, 1))
+        self._ids = itertools.count(1)
+        self._engine: AsyncEngine | None = None
+        self._explaining: asyncio.Task | None = None
+
+    def install(self, engine: AsyncEngine) -> None:
+        if settings.slow_query_ms <= 0 or self._engine is not None:
+            return
+        self._engine = engine
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def _before(_conn, _cursor, _statement, _parameters, context, _executemany) -> None:
+            context._slow_query_start = time.perf_counter()
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def _after(_conn, _cursor, statement, parameters, context, executemany) -> None:
+            duration_ms = (time.perf_counter() - context._slow_query_start) * 1000
+            if duration_ms >= settings.slow_query_ms:
+                self._record(statement, parameters, duration_ms, executemany)
+
+    def records(self) -> list[SlowQuery]:
+        return list(reversed(self._records))
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    def _record(self, statement: str, parameters: Any, duration_ms: float, executemany: bool) -> None:
+        if statement.lstrip()[:7].upper() == "EXPLAIN":
+            return
+        queries = current_queries()
+        if executemany:
+            params = [f"<{len(parameters)} rows>"]
+        elif isinstance(parameters, dict):
+            params = [f"{key}={redact(value)}" for key, value in parameters.items()]
+        else:
+            params = [redact(value) for value in parameters or ()]
+        record = SlowQuery(
+            next(self._ids),
+            statement,
+            params,
+            queries.route_path() if queries is not None else "background",
+            round(duration_ms, 1),
+        )
+        self._records.append(record)
+        logger.warning("Slow query (%.1f ms, %s): %s", duration_ms, record.route, statement[:500])
+
+        if (
+            settings.slow_query_explain
+            and not executemany
+            and not self._explaining
+            and self._engine is not None
+            and self._engine.dialect.name == "postgresql"
+            and statement.lstrip()[:6].upper() == "SELECT"
+        ):
+            self._explaining = asyncio.get_running_loop().create_task(self._explain(record, tuple(parameters or ())))
+
+    async def _explain(self, record: SlowQuery, parameters: tuple) -> None:
+        # Not charged to the request that triggered it.
+        request_queries.set(None)
+        try:
+            async with self._engine.connect() as conn:
+                await conn.exec_driver_sql(
+                    f"SET LOCAL statement_timeout = {int(settings.slow_query_explain_timeout_seconds * 1000)}"
+                )
+                explain = "EXPLAIN (ANALYZE, BUFFERS)" if can_analyze(record.statement) else "EXPLAIN"
+                result = await conn.exec_driver_sql(f"{explain} {record.statement}", parameters)
+                record.plan = "\n".join(row[0] for row in result.all())
+                await conn.rollback()
+        except Exception as exc:
+            record.explain_error = f"{type(exc).__name__}: {exc}"[:500]
+        finally:
+            self._explaining = None
+
+
+slow_query_log = SlowQueryLog()
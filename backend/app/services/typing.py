@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from app.core.config import settings
+from app.services.realtime import realtime_hub
+
+
+class ChatTyping:
+    def __init__(self, chat_type: str, target: str, recipients: list[str]) -> None:
+        self.chat_type = chat_type
+        self.target = target
+        self.recipients = recipients
+        self.typers: dict[str, float] = {}
+        self.accepted_at: dict[str, float] = {}
+        self.last_sent: frozenset[str] = frozenset()
+        self.task: asyncio.Task | None = None
+
+
+class TypingTracker:
+    # Typing state lives in memory per chat and expires on its own. Each chat with someone typing
+    # has one task that sends the current set to the other participants at most once per interval.
+    def __init__(self) -> None:
+        self._chats: dict[str, ChatTyping] = {}
+
+    def refresh(self, login: str, key: str) -> bool:
+        # True when the user is already typing here; the start is absorbed without a lookup.
+        chat = self._chats.get(key)
+        if chat is None or login not in chat.typers:
+            return False
+        now = time.monotonic()
+        if now - chat.accepted_at.get(login, 0.0) >= settings.typing_min_interval_seconds:
+            chat.typers[login] = now + settings.typing_ttl_seconds
+            chat.accepted_at[login] = now
+        return True
+
+    async def start(self, login: str, key: str, chat_type: str, target: str, recipients: list[str]) -> None:
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = ChatTyping(chat_type, target, recipients)
+        # Group membership may have changed since the entry was created.
+        chat.recipients = recipients
+        now = time.monotonic()
+        chat.typers[login] = now + settings.typing_ttl_seconds
+        chat.accepted_at[login] = now
+        if chat.task is None:
+            # Claimed before the first await, so a concurrent start() cannot spawn a second loop.
+            chat.task = asyncio.create_task(self._run(key, chat))
+            await self._broadcast(chat)
+
+    def stop(self, login: str, key: str) -> None:
+        chat = self._chats.get(key)
+        if chat is not None:
+            chat.typers.pop(login, None)
+            chat.accepted_at.pop(login, None)
+
+    async def _run(self, key: str, chat: ChatTyping) -> None:
+        try:
+            while True:
+                await asyncio.sleep(settings.typing_broadcast_interval_ms / 1000)
+                now = time.monotonic()
+                for login in [login for login, expires in chat.typers.items() if expires <= now]:
+                    self.stop(login, key)
+                if frozenset(chat.typers) != chat.last_sent:
+                    await self._broadcast(chat)
+                if not chat.typers:
+                    break
+        finally:
+            if self._chats.get(key) is chat:
+                self._chats.pop(key, None)
+
+    async def _broadcast(self, chat: ChatTyping) -> None:
+        previous, typers = chat.last_sent, frozenset(chat.typers)
+        chat.last_sent = typers
+        base = {"type": "typing", "chat_type": chat.chat_type, "target": chat.target}
+        detailed = chat.chat_type == "private" or len(chat.recipients) <= settings.typing_group_detail_limit
+        # Typers are not shown their own state, and a recipient whose view did not change gets nothing.
+        # Recipients with the same view share one payload object, so it is encoded once.
+        views: dict[frozenset[str] | int, dict] = {}
+        payloads: dict[str, dict] = {}
+        for login in chat.recipients:
+            view, before = typers - {login}, previous - {login}
+            if not detailed:
+                view, before = len(view), len(before)
+            if view == before:
+                continue
+            payload = views.get(view)
+            if payload is None:
+                if chat.chat_type == "private":
+                    # In a private chat the target is the other participant's login.
+                    partner = next((other for other in chat.recipients if other != login), login)
+                    payload = {**base, "target": partner, "logins": sorted(view)}
+                else:
+                    payload = views[view] = {**base, "logins": sorted(view)} if detailed else {**base, "count": view}
+            payloads[login] = payload
+        if payloads:
+            await realtime_hub.notify_each(payloads)
+
+
+typing_tracker = TypingTracker()
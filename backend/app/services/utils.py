@@ -1,6 +1,7 @@
 ﻿from collections.abc import Sequence
+from uuid import UUID
 
-from app.db.models import User
+from app.db.models import Message, User
 
 
 def build_display_name(user: User) -> str:
@@ -8,3 +9,11 @@ def build_display_name(user: User) -> str:
     full = " ".join(p for p in parts if p)
     return full or user.login
 
+
+def build_message_preview(msg: Message, me_id: UUID) -> str:
+    base = msg.text.strip()
+    if not base and msg.file_url:
+        base = "Файл"
+    if msg.sender_id == me_id:
+        return f"Вы: {base}" if base else "Вы: сообщение"
+    return base or "Сообщение"
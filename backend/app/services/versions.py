@@ -0,0 +1,111 @@
+import zlib
+from collections.abc import Iterable
+from contextvars import ContextVar
+from secrets import token_hex
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.invalidation import invalidation_bus
+
+
+USERS_KEY = "users"
+
+# pg_notify payloads are limited to 8000 bytes.
+_PUBLISH_CHUNK = 7000
+
+
+def user_key(login: str) -> str:
+    return f"user:{login}"
+
+
+def notes_key(login: str) -> str:
+    return f"notes:{login}"
+
+
+def chats_key(login: str) -> str:
+    return f"chats:{login}"
+
+
+def chat_keys(chat_key: str, logins: Iterable[str]) -> list[str]:
+    # A write to a chat changes its history and the chat list of everyone in it.
+    return [f"chat:{chat_key}", *(chats_key(login) for login in logins)]
+
+
+# Stamps bumped by the request being served; see VersionStamps.changed_by_others.
+_request_bumps: ContextVar[set[int] | None] = ContextVar("request_bumps", default=None)
+
+
+def track_request_bumps() -> None:
+    _request_bumps.set(set())
+
+
+class VersionStamps:
+    # In-memory version stamps for conditional GETs. Every bump takes the next value of one
+    # process-wide counter, so a stamp never repeats; the boot token changes on restart and on
+    # reset, which makes every ETag issued before it stale. Other workers learn about bumps over
+    # the invalidation bus.
+    def __init__(self) -> None:
+        self._boot = token_hex(4)
+        self._seq = 0
+        self._versions: dict[str, int] = {}
+        invalidation_bus.subscribe("version", self._on_invalidation)
+
+    def etag(self, keys: list[str], extra: str = "") -> str:
+        stamps = ".".join(str(self._versions.get(key, 0)) for key in keys)
+        return f'W/"{self._boot}-{stamps}-{zlib.crc32(extra.encode("utf-8")):x}"'
+
+    def state(self, keys: list[str]) -> tuple[str, list[int]]:
+        return self._boot, [self._versions.get(key, 0) for key in keys]
+
+    def changed_by_others(self, keys: list[str], before: tuple[str, list[int]]) -> bool:
+        # True when a stamp moved since `before` through anything but the current request's own
+        # bumps. A concurrent write may then have landed after the response body was read, so
+        # the current stamps cannot be vouched for.
+        own = _request_bumps.get() or set()
+        boot, versions = self.state(keys)
+        return boot != before[0] or any(now != then and now not in own for now, then in zip(versions, before[1]))
+
+    def bump(self, keys: Iterable[str]) -> None:
+        own = _request_bumps.get()
+        for key in keys:
+            self._seq += 1
+            self._versions[key] = self._seq
+            if own is not None:
+                own.add(self._seq)
+
+    def reset(self) -> None:
+        self._boot = token_hex(4)
+        self._versions.clear()
+
+    async def publish(self, db: AsyncSession, keys: Iterable[str]) -> None:
+        if not invalidation_bus.enabled:
+            return
+        chunk: list[str] = []
+        size = 0
+        for key in keys:
+            if chunk and size + len(key) + 1 > _PUBLISH_CHUNK:
+                await invalidation_bus.publish(db, "version", "\n".join(chunk))
+                chunk, size = [], 0
+            chunk.append(key)
+            size += len(key) + 1
+        if chunk:
+            await invalidation_bus.publish(db, "version", "\n".join(chunk))
+
+    async def bump_committed(self, db: AsyncSession, keys: list[str]) -> None:
+        # For writes that are already committed: other workers are told in a transaction of their own.
+        self.bump(keys)
+        if invalidation_bus.enabled:
+            await self.publish(db, keys)
+            await db.commit()
+
+    async def publish_reset(self, db: AsyncSession) -> None:
+        await invalidation_bus.publish(db, "version", "*")
+
+    def _on_invalidation(self, key: str) -> None:
+        if key == "*":
+            self.reset()
+        else:
+            self.bump(key.split("\n"))
+
+
+version_stamps = VersionStamps()
@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import timeit
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+# Make imports work regardless of current working directory in container.
+for candidate in (Path.cwd(), Path("/app"), Path(__file__).resolve().parents[1]):
+    if (candidate / "app").exists():
+        sys.path.insert(0, str(candidate))
+        break
+
+import orjson
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from pydantic import ValidationError
+
+from app.api.responses import FastJSONResponse
+from app.api.routes import (
+    _admin_user_row,
+    _event_preview,
+    _message_row,
+    _to_message_out,
+    _user_short_row,
+    router,
+)
+from app.core.security import hash_password, verify_password
+from app.db.init_db import _mojibake_score, _repair_text
+from app.db.models import Message, User
+from app.schemas.chat import AdminUserOut, MessageOut, UserShort
+from app.services.realtime import RealtimeHub
+from app.services.utils import build_display_name, build_message_preview
+
+
+BASELINE_PATH = Path(__file__).with_name("benchmark_baseline.json")
+
+TEXTS = [
+    "Коллеги, отчёт по продажам за неделю во вложении",
+    "Добрый день! Подскажите, когда будет готов договор?",
+    "Встреча переносится на 16:00, переговорная 3",
+    "Иванов Пётр Сергеевич, отдел логистики",
+    "Спасибо, получил",
+    "ok",
+]
+# Names as they come out of a UTF-8 export opened as cp1251 or latin1, next to clean ones.
+BROKEN_TEXTS = [t.encode("utf-8").decode("cp1251", errors="replace") for t in TEXTS] + [
+    t.encode("utf-8").decode("latin1") for t in TEXTS
+]
+
+
+def make_user(i: int) -> User:
+    return User(
+        id=uuid4(),
+        login=f"user{i}",
+        first_name=["Анна", "Пётр", "", "Мария"][i % 4],
+        last_name=["Смирнова", "Иванов", "", "Кузнецова"][i % 4],
+        middle_name="Сергеевна" if i % 4 == 0 else "",
+        role="Admin" if i == 0 else "User",
+        phone="+7 900 000-00-00" if i % 3 else "",
+        email=f"user{i}@example.com",
+        position="Менеджер",
+        avatar_url="/uploads/avatar.png" if i % 2 else "",
+        is_blocked=False,
+        is_visible=True,
+        created_at=datetime.now(timezone.utc),
+    )
+
+
+def make_messages(count: int) -> tuple[list[Message], User]:
+    me = make_user(0)
+    other = make_user(1)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(count):
+        sender = me if i % 3 == 0 else other
+        rows.append(
+            Message(
+                id=uuid4(),
+                created_at=now,
+                sender_id=sender.id,
+                sender=sender,
+                text=TEXTS[i % len(TEXTS)],
+                file_url="/uploads/photo.jpg" if i % 10 == 0 else "",
+                file_mime="image/jpeg" if i % 10 == 0 else "",
+                forwarded_from_login=other.login if i % 7 == 0 else "",
+                forwarded_from_name=build_display_name(other) if i % 7 == 0 else "",
+                is_read=bool(i % 2),
+            )
+        )
+    return rows, me
+
+
+class FakeWebSocket:
+    scope: dict = {}
+    query_params: dict = {}
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        pass
+
+    async def send_bytes(self, data: bytes) -> None:
+        pass
+
+
+def fanout_case(loop: asyncio.AbstractEventLoop, recipients: int):
+    hub = RealtimeHub()
+    logins = [f"user{i}" for i in range(recipients)]
+    for login in logins:
+        loop.run_until_complete(hub.connect_events(login, FakeWebSocket()))
+    payload = {"type": "message:new", "chat_type": "group", "chat_id": str(uuid4()), "preview": TEXTS[0]}
+
+    def run() -> None:
+        loop.run_until_complete(hub.notify_users(logins, payload))
+
+    return run
+
+
+def check_rows() -> list[str]:
+    # FastJSONResponse bypasses response_model, so nothing else notices when a *_row builder and
+    # its schema drift apart. Each row must validate and encode exactly like the model would.
+    messages, me = make_messages(20)
+    users = [make_user(i) for i in range(4)]
+    samples = [(MessageOut, _message_row(m, me.id)) for m in messages]
+    samples += [(UserShort, _user_short_row(u, unread_count=i)) for i, u in enumerate(users)]
+    samples += [(AdminUserOut, _admin_user_row(u)) for u in users]
+    problems = []
+    for model, row in samples:
+        try:
+            expected = model.model_validate(row).model_dump(mode="json")
+        except ValidationError as exc:
+            errors = ", ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+            problems.append(f"{model.__name__}: {errors}")
+            continue
+        actual = orjson.loads(FastJSONResponse(row).body)
+        if actual != expected:
+            diff = sorted(k for k in actual.keys() | expected.keys() if actual.get(k) != expected.get(k))
+            problems.append(f"{model.__name__}: fields differ from the schema: {', '.join(diff)}")
+    return sorted(set(problems))
+
+
+def messages_endpoint_cases(loop: asyncio.AbstractEventLoop, count: int) -> dict:
+    # What GET /api/messages does after the query for a long history, next to the response_model
+    # path it replaced: models built per row, validated again and encoded by FastAPI.
+    route = next(r for r in router.routes if r.path == "/api/messages" and "GET" in r.methods)
+    messages, me = make_messages(count)
+
+    def fast() -> None:
+        FastJSONResponse([_message_row(m, me.id) for m in messages])
+
+    def validated() -> None:
+        content = loop.run_until_complete(
+            serialize_response(field=route.response_field, response_content=[_to_message_out(m, me.id) for m in messages])
+        )
+        JSONResponse(content)
+
+    return {f"get_messages.{count // 1000}k.fast": fast, f"get_messages.{count // 1000}k.response_model": validated}
+
+
+def cases(loop: asyncio.AbstractEventLoop) -> dict:
+    users = [make_user(i) for i in range(100)]
+    messages, me = make_messages(1000)
+    rows = [_message_row(m, me.id) for m in messages]
+    models = [_to_message_out(m, me.id) for m in messages]
+    password_hash = hash_password("correct horse")
+    return {
+        "mojibake_score": lambda: [_mojibake_score(t) for t in BROKEN_TEXTS + TEXTS],
+        "repair_text.broken": lambda: [_repair_text(t) for t in BROKEN_TEXTS],
+        "repair_text.clean": lambda: [_repair_text(t) for t in TEXTS],
+        "build_display_name.x100": lambda: [build_display_name(u) for u in users],
+        "build_message_preview.x1000": lambda: [build_message_preview(m, me.id) for m in messages],
+        "event_preview.x1000": lambda: [_event_preview(m.text, m.file_url) for m in messages],
+        "message_row.x1000": lambda: [_message_row(m, me.id) for m in messages],
+        "message_out.x1000": lambda: [_to_message_out(m, me.id) for m in messages],
+        "serialize.orjson.x1000": lambda: FastJSONResponse(rows),
+        "serialize.pydantic.x1000": lambda: [m.model_dump_json() for m in models],
+        **messages_endpoint_cases(loop, 10000),
+        "notify_users.10": fanout_case(loop, 10),
+        "notify_users.100": fanout_case(loop, 100),
+        "notify_users.1000": fanout_case(loop, 1000),
+        "hash_password": lambda: hash_password("correct horse"),
+        "verify_password": lambda: verify_password("correct horse", password_hash),
+    }
+
+
+def calibration() -> None:
+    # Plain interpreter work with no project code in it. Timed in the same process as the cases, it
+    # tells how fast this machine and interpreter are, so results taken elsewhere can be compared.
+    rows = [{"id": i, "name": f"user{i % 97}", "text": TEXTS[i % len(TEXTS)]} for i in range(2000)]
+    sorted(rows, key=lambda row: (row["name"], row["id"]))
+    json.dumps(rows, ensure_ascii=False)
+    "".join(row["text"].lower() for row in rows)
+
+
+def measure(fn, repeat: int, min_time: float) -> float:
+    # Best of several runs, each long enough to swamp timer noise; seconds per call.
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmarks of backend hot paths, compared with stored baselines")
+    parser.add_argument("--save", action="store_true", help=f"store the results as the new {BASELINE_PATH.name}")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--threshold", type=float, default=1.0, help="slowdown against the scaled baseline flagged as a regression"
+    )
+    parser.add_argument("--strict", action="store_true", help="exit with 1 when a case is flagged")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("-k", dest="only", default="", help="only run cases whose name contains this")
+    args = parser.parse_args()
+
+    problems = check_rows()
+    if problems:
+        print("row builders out of sync with their schemas:")
+        for problem in problems:
+            print(f"  {problem}")
+        raise SystemExit(1)
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    previous = baseline.get("results", {})
+    if previous and baseline.get("python") != platform.python_version():
+        print(f"note: baseline was taken on Python {baseline.get('python')}, this is {platform.python_version()}")
+
+    loop = asyncio.new_event_loop()
+    selected = {name: fn for name, fn in cases(loop).items() if args.only in name}
+    # The calibration runs between the cases, and the best of those runs is kept, so a burst of load on
+    # a shared host skews one of them rather than the scale of the whole comparison.
+    calibrations = [measure(calibration, 3, args.min_time)]
+    results = {}
+    for name, fn in selected.items():
+        results[name] = float(f"{measure(fn, args.repeat, args.min_time):.4g}")
+        calibrations.append(measure(calibration, 3, args.min_time))
+    loop.close()
+    calibration_time = min(calibrations)
+    # Baseline times are scaled by how much faster or slower this machine runs the calibration, so
+    # a different machine or interpreter does not read as a regression by itself.
+    scale = calibration_time / baseline["calibration"] if previous and baseline.get("calibration") else 1.0
+    print(f"calibration {format_time(calibration_time)}, baseline scaled by {scale:.2f}\n")
+    regressions = []
+    print(f"{'case':<34}{'time':>12}{'baseline':>12}{'change':>10}")
+    for name in results:
+        line = f"{name:<34}{format_time(results[name]):>12}"
+        if name in previous:
+            expected = previous[name] * scale
+            change = results[name] / expected - 1
+            flag = ""
+            if change > args.threshold:
+                flag = "  SLOWER"
+                regressions.append(name)
+            elif change < -args.threshold:
+                flag = "  faster"
+            line += f"{format_time(expected):>12}{change:>+10.0%}{flag}"
+        print(line)
+
+    if args.save:
+        # Kept results are rescaled to this run's calibration.
+        stored = {name: float(f"{value * scale:.4g}") for name, value in previous.items()} if args.only else {}
+        stored.update(results)
+        args.baseline.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "calibration": float(f"{calibration_time:.4g}"),
+                    "results": stored,
+                },
+                indent=2,
+                sort_keys=True,
+            )
+            + "\n",
+            encoding="utf-8",
+        )
+        print(f"\nbaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} case(s) more than {args.threshold:.0%} slower than the baseline: {', '.join(regressions)}")
+        if args.strict:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
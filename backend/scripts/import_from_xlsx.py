@@ -14,8 +14,9 @@ for candidate in (Path.cwd(), Path("/app"), Path(__file__).resolve().parents[1])
         break
 
 from app.core.security import hash_password
-from app.db.models import ChatGroup, GroupMember, Message, User
+from app.db.models import ChatGroup, Message, User
 from app.db.session import AsyncSessionLocal
+from app.services.groups import group_members_cache, sync_group_members
 
 
 def sheet_values(path: Path, sheet_name: str | None):
@@ -99,20 +100,20 @@ async def import_groups(session, base_file: Path):
             group.name = name
             group.avatar_url = avatar
             group.owner_id = owner.id
-            await session.flush()
-            await session.execute(GroupMember.__table__.delete().where(GroupMember.group_id == group.id))
         else:
             group = ChatGroup(id=UUID(gid), name=name, avatar_url=avatar, owner_id=owner.id)
             session.add(group)
-            await session.flush()
+        await session.flush()
 
         member_logins = [x.strip() for x in members_raw.split(",") if x.strip()]
         if owner.login not in member_logins:
             member_logins.append(owner.login)
 
+        member_ids = set()
         for login in member_logins:
             member = await upsert_user(session, login)
-            session.add(GroupMember(group_id=group.id, user_id=member.id))
+            member_ids.add(member.id)
+        await sync_group_members(session, group.id, member_ids)
 
 
 async def import_messages(session, base_file: Path):
@@ -178,6 +179,7 @@ async def main():
         await import_profiles(session, base_file)
         await import_groups(session, base_file)
         await import_messages(session, base_file)
+        await group_members_cache.publish_invalidation(session)
         await session.commit()
 
 
@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from uuid import uuid4
+
+# Make imports work regardless of current working directory in container.
+for candidate in (Path.cwd(), Path("/app"), Path(__file__).resolve().parents[1]):
+    if (candidate / "app").exists():
+        sys.path.insert(0, str(candidate))
+        break
+
+import websockets
+from sqlalchemy import select
+
+from app.core.security import create_access_token, hash_password
+from app.db.models import ChatGroup, GroupMember, User
+from app.db.session import AsyncSessionLocal, engine
+
+try:
+    import httpx
+except ImportError:  # only this script needs it
+    httpx = None
+
+
+OPS = ("send", "history", "chats", "upload")
+MARKER = "load:"
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+def is_local_database() -> bool:
+    # No host means a Unix socket on this machine.
+    return engine.url.get_backend_name() == "sqlite" or engine.url.host in (None, *LOCAL_HOSTS)
+
+
+def parse_mix(text: str) -> dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPS:
+            raise SystemExit(f"unknown op in --mix: {name}")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+async def seed(prefix: str, users: int, groups: int, group_size: int, rng: random.Random) -> dict[str, list[str]]:
+    # Idempotent: existing load users and groups are reused, so runs against one database compare.
+    logins = [f"{prefix}{i:05d}" for i in range(users)]
+    password_hash = hash_password("load")
+    async with AsyncSessionLocal() as db:
+        existing = {u.login: u for u in (await db.scalars(select(User).where(User.login.in_(logins)))).all()}
+        for login in logins:
+            if login not in existing:
+                existing[login] = User(login=login, password_hash=password_hash, first_name="Нагрузка", last_name=login)
+                db.add(existing[login])
+        await db.flush()
+
+        memberships: dict[str, list[str]] = {}
+        for i in range(groups):
+            name = f"{prefix}-group-{i}"
+            group = await db.scalar(select(ChatGroup).where(ChatGroup.name == name))
+            if group is None:
+                members = rng.sample(logins, min(group_size, len(logins)))
+                group = ChatGroup(name=name, owner_id=existing[members[0]].id)
+                db.add(group)
+                await db.flush()
+                for login in members:
+                    db.add(GroupMember(group_id=group.id, user_id=existing[login].id))
+            rows = await db.scalars(
+                select(User.login).join(GroupMember, GroupMember.user_id == User.id).where(GroupMember.group_id == group.id)
+            )
+            memberships[str(group.id)] = list(rows.all())
+        await db.commit()
+    await engine.dispose()
+    return memberships
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.sent_at: dict[str, tuple[float, str, int]] = {}
+        self.delivery: list[float] = []
+        self.expected = 0
+
+
+class Recipient:
+    def __init__(self, login: str, url: str, stats: Stats) -> None:
+        self.login = login
+        self.url = url
+        self.stats = stats
+        self.ready = asyncio.Event()
+
+    async def run(self, stop: asyncio.Event) -> None:
+        async with websockets.connect(self.url, max_size=None) as ws:
+            self.ready.set()
+            pinger = asyncio.create_task(self._ping(ws, stop))
+            try:
+                while not stop.is_set():
+                    try:
+                        frame = await asyncio.wait_for(ws.recv(), timeout=1)
+                    except asyncio.TimeoutError:
+                        continue
+                    received = time.perf_counter()
+                    data = json.loads(frame)
+                    for item in data if isinstance(data, list) else [data]:
+                        self._on_event(item, received)
+            finally:
+                pinger.cancel()
+
+    async def _ping(self, ws, stop: asyncio.Event) -> None:
+        # The server drops sockets that stay silent past its idle timeout.
+        while not stop.is_set():
+            await asyncio.sleep(20)
+            await ws.send("ping")
+
+    def _on_event(self, event: dict, received: float) -> None:
+        preview = event.get("preview", "")
+        if event.get("type") != "message:new" or not preview.startswith(MARKER):
+            return
+        sent = self.stats.sent_at.get(preview)
+        if sent and sent[1] != self.login:
+            self.stats.delivery.append(received - sent[0])
+
+
+async def worker(
+    client,
+    login: str,
+    token: str,
+    args,
+    mix: dict[str, int],
+    memberships: dict[str, list[str]],
+    logins: list[str],
+    connected: set[str],
+    stats: Stats,
+    stop: asyncio.Event,
+    rng: random.Random,
+) -> None:
+    headers = {"Authorization": f"Bearer {token}"}
+    my_groups = [gid for gid, members in memberships.items() if login in members]
+    ops, weights = list(mix), list(mix.values())
+    payload = b"x" * (args.upload_kb * 1024)
+    while not stop.is_set():
+        op = rng.choices(ops, weights)[0]
+        if my_groups and rng.random() < args.group_share:
+            chat_type, target = "group", rng.choice(my_groups)
+            recipients = memberships[target]
+        else:
+            chat_type, target = "private", rng.choice([other for other in logins if other != login])
+            recipients = [login, target]
+        started = time.perf_counter()
+        try:
+            if op == "send":
+                marker = f"{MARKER}{uuid4().hex}"
+                receivers = sum(1 for other in recipients if other != login and other in connected)
+                stats.sent_at[marker] = (started, login, receivers)
+                response = await client.post(
+                    "/api/messages", data={"chat_type": chat_type, "target": target, "text": marker}, headers=headers
+                )
+                if response.status_code == 200:
+                    stats.expected += receivers
+            elif op == "history":
+                response = await client.get(
+                    "/api/messages", params={"chat_type": chat_type, "target": target}, headers=headers
+                )
+            elif op == "chats":
+                response = await client.get("/api/chats/active", headers=headers)
+            else:
+                response = await client.post(
+                    "/api/upload", files={"file": ("load.bin", payload, "application/octet-stream")}, headers=headers
+                )
+            if response.status_code >= 400:
+                stats.errors[op] += 1
+            else:
+                stats.latency[op].append(time.perf_counter() - started)
+        except Exception:
+            stats.errors[op] += 1
+        if args.think_ms:
+            await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+
+
+def report(stats: Stats, elapsed: float, sockets: int) -> None:
+    print(f"\n{elapsed:.1f}s, {sockets} event sockets")
+    print(f"{'op':<10}{'ok':>8}{'err':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    total = 0
+    for op in OPS:
+        values = stats.latency.get(op, [])
+        if not values and not stats.errors.get(op):
+            continue
+        total += len(values)
+        print(
+            f"{op:<10}{len(values):>8}{stats.errors.get(op, 0):>6}{len(values) / elapsed:>9.1f}"
+            + "".join(f"{percentile(values, p) * 1000:>10.1f}" for p in (50, 95, 99, 100))
+        )
+    print(f"{'total':<10}{total:>8}{sum(stats.errors.values()):>6}{total / elapsed:>9.1f}")
+
+    delivered = stats.delivery
+    print(
+        f"\nevent delivery (send -> message:new on other sockets): {len(delivered)}/{stats.expected} received, "
+        + ", ".join(f"p{p} {percentile(delivered, p) * 1000:.1f} ms" for p in (50, 95, 99))
+        + f", max {max(delivered, default=0) * 1000:.1f} ms"
+    )
+
+
+async def run(args) -> None:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    print(f"seeding {args.users} users and {args.groups} groups of {args.group_size} ...")
+    memberships = await seed(args.prefix, args.users, args.groups, args.group_size, rng)
+    logins = [f"{args.prefix}{i:05d}" for i in range(args.users)]
+    tokens = {login: create_access_token(login) for login in logins}
+
+    stats = Stats()
+    stop = asyncio.Event()
+    ws_base = args.base_url.replace("http", "ws", 1).rstrip("/")
+    query = "&batch=1" if args.ws_batch else ""
+    recipients = [
+        Recipient(login, f"{ws_base}/api/ws/events?token={tokens[login]}{query}", stats)
+        for login in logins[: args.sockets]
+    ]
+    socket_tasks = [asyncio.create_task(r.run(stop)) for r in recipients]
+    await asyncio.wait_for(asyncio.gather(*(r.ready.wait() for r in recipients)), timeout=60)
+    connected = {r.login for r in recipients}
+    print(f"{len(connected)} sockets open, running {args.concurrency} clients for {args.duration}s ...")
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        workers = [
+            asyncio.create_task(
+                worker(
+                    client,
+                    logins[i % len(logins)],
+                    tokens[logins[i % len(logins)]],
+                    args,
+                    mix,
+                    memberships,
+                    logins,
+                    connected,
+                    stats,
+                    stop,
+                    random.Random(args.seed * 1000 + i),
+                )
+            )
+            for i in range(args.concurrency)
+        ]
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*workers, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+    # Give in-flight events a moment to arrive before the sockets close.
+    await asyncio.sleep(args.drain)
+    await asyncio.gather(*socket_tasks, return_exceptions=True)
+    report(stats, elapsed, len(connected))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="HTTP + WebSocket load test against a running backend")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--prefix", default="load", help="login prefix of the seeded users")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--group-size", type=int, default=15)
+    parser.add_argument("--sockets", type=int, default=100, help="users holding an /api/ws/events socket")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent HTTP clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--mix", default="send=40,history=30,chats=25,upload=5", help="op weights")
+    parser.add_argument("--group-share", type=float, default=0.6, help="share of ops aimed at a group chat")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between ops per client")
+    parser.add_argument("--upload-kb", type=int, default=64)
+    parser.add_argument("--ws-batch", action="store_true", help="open sockets with ?batch=1")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for late events")
+    parser.add_argument("--seed", type=int, default=1, help="random seed; the same seed replays the same traffic")
+    parser.add_argument("--i-know", action="store_true", help="allow seeding a database that is not on this machine")
+    args = parser.parse_args()
+    if httpx is None:
+        raise SystemExit("load_test.py needs httpx: pip install -r requirements-dev.txt")
+    if not is_local_database() and not args.i_know:
+        raise SystemExit(
+            f"DATABASE_URL points at {engine.url.host}, not this machine. The load test writes users, groups and "
+            "messages there; pass --i-know to run it anyway."
+        )
+    if args.sockets > args.users:
+        raise SystemExit("--sockets cannot exceed --users")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import sys
+import zlib
+from pathlib import Path
+from uuid import uuid4
+
+# Make imports work regardless of current working directory in container.
+for candidate in (Path.cwd(), Path("/app"), Path(__file__).resolve().parents[1]):
+    if (candidate / "app").exists():
+        sys.path.insert(0, str(candidate))
+        break
+
+from app.services.realtime import encode_event, encode_event_batch, encoding_available
+
+
+PREVIEWS = [
+    "Коллеги, отчёт по продажам за неделю во вложении",
+    "Добрый день! Подскажите, когда будет готов договор?",
+    "Перезвоню через пять минут",
+    "Файл",
+    "Встреча переносится на 16:00, переговорная 3",
+    "Спасибо, получил",
+]
+
+
+def sample_events(i: int = 0) -> dict[str, dict]:
+    group_id = str(uuid4())
+    preview = PREVIEWS[i % len(PREVIEWS)]
+    chat = {
+        "id": group_id,
+        "name": "Отдел продаж — Москва",
+        "avatar_url": "https://example.com/uploads/avatar.png",
+        "owner_login": "ivanov",
+        "unread_count": i % 7,
+        "last_message": preview,
+        "last_time": f"14:{i % 60:02d}",
+        "is_group": True,
+        "members_count": 42,
+    }
+    return {
+        "message:new": {
+            "type": "message:new",
+            "chat_type": "group",
+            "target": group_id,
+            "sender_login": "ivanov",
+            "sender_name": "Иван Иванов",
+            "preview": preview,
+            "chat": chat,
+        },
+        "chat:update": {
+            "type": "chat:update",
+            "chat_type": "group",
+            "target": group_id,
+            "name": chat["name"],
+            "avatar_url": chat["avatar_url"],
+            "members_added": ["petrov"],
+            "members_removed": [],
+            "chat": chat,
+        },
+        "call:invite": {"type": "call:invite", "from_login": "ivanov", "from_name": "Иван Иванов"},
+        "legacy message:new": {
+            "type": "message:new",
+            "chat_type": "group",
+            "target": group_id,
+            "sender_login": "ivanov",
+            "sender_name": "Иван Иванов",
+            "preview": preview,
+        },
+    }
+
+
+def deflated_sizes(frames: list, level: int) -> list[int]:
+    # permessage-deflate with context takeover: one raw deflate stream per connection.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    sizes = []
+    for frame in frames:
+        data = frame.encode("utf-8") if isinstance(frame, str) else frame
+        out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        sizes.append(len(out) - 4)  # the trailing 00 00 ff ff is stripped on the wire
+    return sizes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure bytes per realtime event for each wire encoding")
+    parser.add_argument("--repeat", type=int, default=50, help="events per simulated connection")
+    parser.add_argument("--level", type=int, default=6, help="deflate compression level")
+    args = parser.parse_args()
+
+    encodings = ["json"] + (["msgpack"] if encoding_available("msgpack") else [])
+    print(f"average bytes per event over {args.repeat} distinct events on one connection")
+    print(f"{'event':<22}{'legacy json':>12}" + "".join(f"{e:>10}{e + '+defl':>14}" for e in encodings))
+    for name, payload in sample_events().items():
+        legacy = len(json.dumps(payload).encode("utf-8"))
+        row = f"{name:<22}{legacy:>12}"
+        for encoding in encodings:
+            frame = encode_event(payload, encoding)
+            raw = len(frame.encode("utf-8") if isinstance(frame, str) else frame)
+            frames = [encode_event(sample_events(i)[name], encoding) for i in range(args.repeat)]
+            deflated = deflated_sizes(frames, args.level)
+            row += f"{raw:>10}{sum(deflated) / len(deflated):>14.1f}"
+        print(row)
+
+    events = list(sample_events().values())[:3]
+    print()
+    print(f"batch of {len(events)} events (one frame):")
+    for encoding in encodings:
+        frame = encode_event_batch([encode_event(e, encoding) for e in events], encoding)
+        raw = len(frame.encode("utf-8") if isinstance(frame, str) else frame)
+        print(f"  {encoding:<8}{raw:>8} bytes, deflated {deflated_sizes([frame], args.level)[0]} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -75,6 +75,7 @@ self.addEventListener("push", (event) => {
     body,
     icon: "/icons/icon-192.png",
     badge: "/icons/icon-192.png",
+    ...(chatKey ? { tag: chatKey, renotify: true } : {}),
     data: {
       ...data,
       url: data.url || "/",
@@ -770,9 +770,11 @@ export default function App() {
         if (ws.readyState === WebSocket.OPEN) ws.send("ping");
       }, 25000);
     };
-    ws.onclose = () => {
+    ws.onclose = (event) => {
       if (heartbeatRef.current) clearInterval(heartbeatRef.current);
       if (reconnectRef.current.stopped) return;
+      // 4008: a newer tab took this socket's place under the per-user limit; reconnecting would evict it in turn.
+      if (event.code === 4008) return;
       const attempt = Math.min(reconnectRef.current.attempt + 1, 8);
       reconnectRef.current.attempt = attempt;
       const delayMs = Math.min(20000, 1000 * 2 ** (attempt - 1));
@@ -1083,15 +1085,18 @@ export default function App() {
         clearCallWaitTimer();
         setCallStatus("В звонке");
       }
-      if (msg.type === "ice" && msg.candidate) {
-        if (pc.remoteDescription && pc.remoteDescription.type) {
-          try {
-            await pc.addIceCandidate(msg.candidate);
-          } catch {
-            // ignore
+      if (msg.type === "ice") {
+        const candidates = msg.candidates || (msg.candidate ? [msg.candidate] : []);
+        for (const candidate of candidates) {
+          if (pc.remoteDescription && pc.remoteDescription.type) {
+            try {
+              await pc.addIceCandidate(candidate);
+            } catch {
+              // ignore
+            }
+          } else {
+            pendingIceCandidatesRef.current.push(candidate);
           }
-        } else {
-          pendingIceCandidatesRef.current.push(msg.candidate);
         }
       }
       if (msg.type === "hangup") endCall(false);
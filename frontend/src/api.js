@@ -329,7 +329,7 @@ export function openEventsSocket(token, onMessage) {
 export function openCallSocket(token, roomId, onMessage) {
   const proto = window.location.protocol === "https:" ? "wss" : "ws";
   const ws = new WebSocket(
-    `${proto}://${window.location.host}/api/ws/calls/${encodeURIComponent(roomId)}?token=${encodeURIComponent(token)}`
+    `${proto}://${window.location.host}/api/ws/calls/${encodeURIComponent(roomId)}?batch=1&token=${encodeURIComponent(token)}`
   );
   ws.onmessage = (event) => {
     try {